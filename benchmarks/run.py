@@ -0,0 +1,394 @@
+"""
+Benchmarks of rendering and encoding hot paths of ifigures.
+
+Usage (from the repository root):
+
+    python benchmarks/run.py                          # run all cases
+    python benchmarks/run.py --save baseline.json     # record baseline
+    python benchmarks/run.py --compare baseline.json  # compare with baseline
+    python benchmarks/run.py -k get_png -k html       # only matching cases
+
+Each case runs in a separate Python process, so that its peak resident
+memory (RSS) can be measured. For each case wall time (best of `--repeat`
+runs), peak RSS and number of output bytes are reported. Figures are
+synthetic and drawn without LaTeX text (`text.usetex` is off), so that
+results don't depend on installed fonts. Cases that need LaTeX (pdflatex
+and ImageMagick convert) or off-screen rendering with pyvista are skipped
+when these are not available.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Skip(Exception):
+    """Raised by case setup when its requirements are not available"""
+
+
+def _setup_matplotlib():
+    import matplotlib
+    matplotlib.use("Agg")
+    import ifigures  # sets ifigures style
+    matplotlib.rcParams["text.usetex"] = False
+
+
+def _line_figure(width, height, dpi, points=500):
+    import numpy as np
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots(figsize=(width, height), dpi=dpi)
+    x = np.linspace(0, 10, points)
+    for k in range(1, 4):
+        ax.plot(x, np.sin(k * x) / k, label="k = %d" % k)
+    ax.set_xlabel("time")
+    ax.set_ylabel("amplitude")
+    ax.legend()
+    return fig
+
+
+def _synthetic_image(width, height):
+    """Smooth gradient with few shapes, compresses like a rendered figure"""
+    import numpy as np
+    from PIL import Image, ImageDraw
+    y, x = np.mgrid[0:height, 0:width]
+    rgba = np.zeros((height, width, 4), dtype=np.uint8)
+    rgba[..., 0] = 255 * x // max(1, width - 1)
+    rgba[..., 1] = 255 * y // max(1, height - 1)
+    rgba[..., 2] = 128
+    rgba[..., 3] = 255
+    image = Image.fromarray(rgba, "RGBA")
+    draw = ImageDraw.Draw(image)
+    for i in range(20):
+        draw.ellipse([i * width // 25, i * height // 30,
+                      i * width // 25 + width // 10,
+                      i * height // 30 + height // 10],
+                     outline=(0, 0, 0, 255), width=3)
+    return image
+
+
+# Every case does its setup and returns function that runs the measured
+# code once and returns number of output bytes.
+
+def _encoder(encoder):
+    """Encoder from (class name in ifigures.encoders, arguments), or None"""
+    if encoder is None:
+        return None
+    from ifigures import encoders
+    name, arguments = encoder
+    return getattr(encoders, name)(**arguments)
+
+
+def case_get_png(width, height, dpi, compress, encoder=None):
+    def setup():
+        _setup_matplotlib()
+        from ifigures.interact import _get_png
+        fig = _line_figure(width, height, dpi)
+        imageEncoder = _encoder(encoder)
+        return lambda: len(_get_png(fig, compress=compress,
+                                    encoder=imageEncoder))
+    return setup
+
+
+def case_get_encoded_png(width, height, compress):
+    def setup():
+        _setup_matplotlib()
+        from ifigures.timelines import _get_encoded_png
+        image = _synthetic_image(width, height)
+        return lambda: len(_get_encoded_png(image, compress=compress))
+    return setup
+
+
+def _plot(omega, phase):
+    import numpy as np
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots(figsize=(3, 2), dpi=72)
+    x = np.linspace(0, 10, 200)
+    ax.plot(x, np.sin(omega * x + phase))
+    ax.set_ylim(-1.1, 1.1)
+    return fig, "omega = %.2f, phase = %.2f" % (omega, phase)
+
+
+def _marker_plot(omega, phase):
+    """Marker moving along a curve that is the same in all frames"""
+    import numpy as np
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots(figsize=(3, 2), dpi=72)
+    x = np.linspace(0, 10, 200)
+    ax.plot(x, np.sin(x))
+    t = omega / 5 + phase
+    ax.plot([t], [np.sin(t)], "o")
+    ax.set_ylim(-1.1, 1.1)
+    return fig, "t = %.2f" % t
+
+
+def case_output_html(frames, encoder=None, function=_plot, **options):
+    def setup():
+        _setup_matplotlib()
+        from ifigures import InteractiveFigure, RangeWidget, RadioWidget
+        phases = [0, 1] if frames > 1 else [0]
+        figure = InteractiveFigure(function,
+                                   omega=RangeWidget(1, frames // len(phases), 1),
+                                   phase=RadioWidget(phases))
+        directory = tempfile.mkdtemp()
+        fileName = os.path.join(directory, "figure.html")
+
+        def run():
+            figure.saveStandaloneHTML(fileName, encoder=_encoder(encoder),
+                                      **options)
+            return figure.buildReport["bytes"]
+        return run
+    return setup
+
+
+def case_energy_levels():
+    _setup_matplotlib()
+    import numpy as np
+    import matplotlib.pyplot as plt
+    from ifigures import EnergyLevels
+    from ifigures.interact import _get_png
+
+    def run():
+        levels = EnergyLevels()
+        levels.add("g", 0, 0)
+        levels.add("e", 1, 1)
+        levels.add("r", 0, 2)
+        levels.addArrow(0, 1, strength=0.5)
+        levels.addArrow(1, 2, strength=1j)
+        levels.setState(np.array([0.6, 0.6j, 0.5]))
+        fig, ax = plt.subplots(figsize=(4, 4), dpi=100)
+        levels.plot(ax, labels=False)
+        return len(_get_png(fig))
+    return run
+
+
+def case_density_matrix(dimension):
+    def setup():
+        _setup_matplotlib()
+        import numpy as np
+        import matplotlib.pyplot as plt
+        from ifigures import DensityMatrix
+        from ifigures.interact import _get_png
+        rng = np.random.default_rng(1)
+        psi = rng.normal(size=dimension) + 1j * rng.normal(size=dimension)
+        psi /= np.linalg.norm(psi)
+        rho = np.outer(psi, psi.conj())
+
+        def run():
+            fig, ax = plt.subplots(figsize=(4, 4), dpi=100)
+            DensityMatrix().plot(ax, rho)
+            return len(_get_png(fig))
+        return run
+    return setup
+
+
+def case_latex2png():
+    for tool in ("pdflatex", "convert"):
+        if shutil.which(tool) is None:
+            raise Skip("%s is not installed" % tool)
+    _setup_matplotlib()
+    from ifigures import latex2png
+    # empty cache, so that every run calls LaTeX
+    latex2png.texcache = tempfile.mkdtemp()
+    generator = latex2png()
+    counter = [0]
+
+    def run():
+        counter[0] += 1
+        fileName = generator.make_png(r"$\Omega_{%d} = \sqrt{\Omega^2 + \Delta^2}$"
+                                      % counter[0], fontsize=12, dpi=300)
+        return os.path.getsize(fileName)
+    return run
+
+
+def case_bloch_sphere():
+    try:
+        import pyvista
+    except ImportError:
+        raise Skip("pyvista is not installed")
+    _setup_matplotlib()
+    import matplotlib.pyplot as plt
+    from ifigures import BlochSphere
+    from ifigures.interact import _get_png
+    try:
+        sphere = BlochSphere(resolution=1)
+        fig, ax = plt.subplots()
+        sphere.plot(ax, labelAxis=False)
+        plt.close(fig)
+    except Exception as e:
+        raise Skip("pyvista can't render off screen (%s)" % e)
+
+    def run():
+        sphere = BlochSphere(resolution=1)
+        sphere.addStateArrow(1, 1, 1)
+        fig, ax = plt.subplots(figsize=(4, 4), dpi=100)
+        sphere.plot(ax, labelAxis=False)
+        return len(_get_png(fig))
+    return run
+
+
+CASES = {
+    "get_png_small": case_get_png(4, 3, 100, compress=False),
+    "get_png_large": case_get_png(10, 8, 200, compress=False),
+    "get_png_small_compress": case_get_png(4, 3, 100, compress=True),
+    "get_png_large_compress": case_get_png(10, 8, 200, compress=True),
+    "get_png_large_zlib_1": case_get_png(10, 8, 200, compress=False,
+                                         encoder=("PNGEncoder",
+                                                  {"compressLevel": 1})),
+    "get_png_large_webp": case_get_png(10, 8, 200, compress=False,
+                                       encoder=("WebPEncoder", {})),
+    "get_encoded_png_small": case_get_encoded_png(800, 600, compress=False),
+    "get_encoded_png_large": case_get_encoded_png(4000, 3000, compress=False),
+    "get_encoded_png_small_compress": case_get_encoded_png(800, 600, compress=True),
+    "html_10_frames": case_output_html(10),
+    "html_100_frames": case_output_html(100),
+    "html_100_frames_compress": case_output_html(100, compress=True),
+    "html_100_frames_shared_palette": case_output_html(100, compress="shared"),
+    "html_100_frames_size_budget": case_output_html(100, compress="auto",
+                                                   sizeBudget=1000000),
+    "html_100_frames_trim": case_output_html(100, trim=True),
+    "html_100_frames_webp": case_output_html(100, encoder=("WebPEncoder", {})),
+    "html_100_frames_marker_viewer": case_output_html(100, layout="viewer",
+                                                      function=_marker_plot),
+    "html_100_frames_marker_tiles": case_output_html(100, layout="tiles",
+                                                     function=_marker_plot),
+    "html_100_frames_viewer_external": case_output_html(100, layout="viewer",
+                                                        assets="external"),
+    "energy_levels": case_energy_levels,
+    "density_matrix_4": case_density_matrix(4),
+    "density_matrix_16": case_density_matrix(16),
+    "latex2png": case_latex2png,
+    "bloch_sphere": case_bloch_sphere,
+}
+
+
+def _peak_rss():
+    """Peak resident memory of this process in MB, or None if unknown"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024**2 if sys.platform == "darwin" else 1024)
+
+
+def run_case(name, repeat):
+    """Runs case in this process and returns its result"""
+    try:
+        run = CASES[name]()
+    except Skip as e:
+        return {"skipped": str(e)}
+    except ImportError as e:
+        return {"skipped": "import failed (%s)" % e}
+    outputBytes = run()  # warm up: imports, font cache
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        outputBytes = run()
+        times.append(time.perf_counter() - start)
+    return {"seconds": min(times), "peakRSS": _peak_rss(),
+            "bytes": int(outputBytes)}
+
+
+def run_isolated(name, repeat):
+    """Runs case in a new Python process"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [REPOSITORY] + ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else []))
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--case", name,
+         "--repeat", str(repeat)],
+        capture_output=True, text=True, env=env)
+    if completed.returncode != 0:
+        lines = completed.stderr.strip().splitlines()
+        return {"error": lines[-1] if lines else "exit code %d"
+                % completed.returncode}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def compare(results, baseline, tolerance):
+    """Prints comparison with baseline and returns names of regressed cases"""
+    regressed = []
+    print("\n%-34s %10s %10s %8s" % ("case", "baseline", "now", "change"))
+    for name, result in results.items():
+        previous = baseline["cases"].get(name)
+        if previous is None or "seconds" not in previous or "seconds" not in result:
+            continue
+        change = result["seconds"] / previous["seconds"] - 1
+        flags = []
+        if change > tolerance:
+            flags.append("SLOWER")
+        if (result.get("peakRSS") and previous.get("peakRSS")
+                and result["peakRSS"] > previous["peakRSS"] * (1 + tolerance)):
+            flags.append("MORE MEMORY")
+        if result["bytes"] > previous["bytes"] * (1 + tolerance):
+            flags.append("LARGER OUTPUT")
+        print("%-34s %9.4fs %9.4fs %+7.0f%% %s" % (
+            name, previous["seconds"], result["seconds"], 100 * change,
+            " ".join(flags)))
+        if flags:
+            regressed.append(name)
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-k", dest="select", action="append", default=[],
+                        help="run only cases whose name contains this string")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of timed runs of each case (default 3)")
+    parser.add_argument("--save", help="save results as JSON baseline")
+    parser.add_argument("--compare", help="compare with JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="relative change reported as regression (default 0.2)")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(args.case, args.repeat)))
+        return 0
+
+    names = [name for name in CASES
+             if not args.select or any(s in name for s in args.select)]
+    results = {}
+    print("%-34s %10s %10s %12s" % ("case", "time", "peak RSS", "output"))
+    for name in names:
+        result = run_isolated(name, args.repeat)
+        results[name] = result
+        if "seconds" in result:
+            rss = ("%7.1f MB" % result["peakRSS"]
+                   if result["peakRSS"] is not None else "-")
+            print("%-34s %9.4fs %10s %10d B" % (name, result["seconds"], rss,
+                                                result["bytes"]))
+        else:
+            print("%-34s %s" % (name, "skipped: " + result["skipped"]
+                                if "skipped" in result
+                                else "ERROR: " + result["error"]))
+
+    if args.save:
+        import matplotlib
+        with open(args.save, "w") as f:
+            json.dump({"python": platform.python_version(),
+                       "platform": platform.platform(),
+                       "matplotlib": matplotlib.__version__,
+                       "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                       "cases": results}, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 1 if any("error" in result for result in results.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,16 @@
 __version__ = "0.2.8"
 
-from .interact import InteractiveFigure
+from .interact import InteractiveFigure, UpdatingFigure, batch
 from .widgets import RadioWidget, RangeWidget, RangeWidgetViridis, DropDownWidget
 from .timelines import InteractiveTimeline
 from .latex2png import latex2png
 from .amoplots import EnergyLevels, EnergyLevelsOld, blobAnnotate, xAnnotate, yAnnotate, equation, BlochSphere, DensityMatrix
 from .style import getComplexColor
+from .cache import FrameCache, memoize
+from .encoders import PNGEncoder, WebPEncoder, AVIFEncoder
 
-__all__ = ["InteractiveFigure", "RadioWidget", "RangeWidget", "RangeWidgetViridis",
+__all__ = ["InteractiveFigure", "UpdatingFigure", "batch", "RadioWidget", "RangeWidget", "RangeWidgetViridis",
            "DropDownWidget", "InteractiveTimeline", "latex2png",
            "EnergyLevels", "blobAnnotate", "xAnnotate", "yAnnotate", "equation", "BlochSphere", "DensityMatrix",
-           "EnergyLevelsOld", "getComplexColor"]
\ No newline at end of file
+           "EnergyLevelsOld", "getComplexColor", "FrameCache", "memoize",
+           "PNGEncoder", "WebPEncoder", "AVIFEncoder"]
\ No newline at end of file
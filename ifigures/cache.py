@@ -0,0 +1,407 @@
+"""
+On-disk cache of rendered interactive figure frames.
+
+Frames are stored in ~/.matplotlib/frame.cache (next to the tex.cache used
+by latex2png), under md5 hash of the figure function code, values of
+variables it uses from closure and module globals, function arguments and
+rendering settings. Rebuilding a figure after a change of caption or of
+one widget range renders only new or changed combinations.
+
+Results of expensive calculations shared between frames can be cached with
+`memoize` decorator, in memory and in ~/.matplotlib/memoize.cache.
+"""
+
+import functools
+import hashlib
+import inspect
+import logging
+import os
+import pickle
+import re
+import threading
+import types
+from collections import OrderedDict
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+
+import numpy as np
+import matplotlib as mpl
+
+_log = logging.getLogger(__name__)
+
+# rcParams that don't change the rendered figure
+_IGNORED_RCPARAMS = ("backend", "backend_fallback", "interactive",
+                     "webagg.port", "webagg.address", "webagg.open_in_browser",
+                     "webagg.port_retries", "figure.max_open_warning")
+
+
+def _value_bytes(value):
+    """Stable byte representation of a value used by the figure function.
+    Raises TypeError if value can't be pickled (repr of such objects often
+    contains memory address, that changes on every run)."""
+    if isinstance(value, np.ndarray):
+        return repr((value.dtype, value.shape)).encode("utf-8") + value.tobytes()
+    try:
+        return pickle.dumps(value, protocol=4)
+    except Exception as error:
+        raise TypeError("%s can't be pickled" % type(value).__qualname__) \
+            from error
+
+
+def _hash_value(value, h):
+    """Update hash h with value, or only with its type if it can't be
+    pickled (e.g. locks)"""
+    try:
+        h.update(_value_bytes(value))
+    except TypeError:
+        h.update(type(value).__qualname__.encode("utf-8"))
+
+
+def _hash_function(function, h, seen):
+    """Update hash h with code of a function, and values of closure and
+    global variables that function refers to. Referred functions defined
+    in the same module are hashed recursively."""
+    if id(function) in seen:
+        return
+    if getattr(function, "_memoized", False):
+        # closure of memoize wrapper holds results and lock, that change
+        # from run to run; results depend only on the wrapped function
+        seen.add(id(function))
+        _hash_function(function.__wrapped__, h, seen)
+        return
+    code = getattr(function, "__code__", None)
+    if code is None:
+        # callable objects (e.g. UpdatingFigure) are hashed through
+        # functions stored in their attributes
+        if hasattr(function, "__dict__"):
+            seen.add(id(function))
+            h.update(type(function).__qualname__.encode("utf-8"))
+            for name, value in sorted(vars(function).items()):
+                if isinstance(value, types.FunctionType):
+                    h.update(name.encode("utf-8"))
+                    _hash_function(value, h, seen)
+        return
+    seen.add(id(function))
+
+    def hash_code(code):
+        h.update(code.co_code)
+        h.update(repr(code.co_names).encode("utf-8"))
+        for const in code.co_consts:
+            if isinstance(const, types.CodeType):
+                hash_code(const)
+            else:
+                h.update(repr(const).encode("utf-8"))
+
+    hash_code(code)
+    h.update(repr(getattr(function, "__defaults__", None)).encode("utf-8"))
+
+    for cell in (function.__closure__ or ()):
+        try:
+            value = cell.cell_contents
+        except ValueError:  # empty cell
+            continue
+        if isinstance(value, types.FunctionType):
+            _hash_function(value, h, seen)
+        else:
+            _hash_value(value, h)
+
+    globs = getattr(function, "__globals__", {})
+    for name in _global_names(code):
+        if name not in globs:
+            continue
+        value = globs[name]
+        if isinstance(value, types.FunctionType):
+            # only helper functions defined next to the figure function,
+            # library functions are not tracked
+            if value.__module__ == function.__module__:
+                _hash_function(value, h, seen)
+        elif isinstance(value, (int, float, complex, str, bytes, bool,
+                                tuple, list, dict, np.ndarray, np.number)):
+            h.update(name.encode("utf-8"))
+            _hash_value(value, h)
+        # modules, classes and other objects are not tracked
+
+
+def _global_names(code):
+    """Names of global variables used by code (including nested code)"""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _global_names(const)
+    return sorted(names)
+
+
+class FrameCache:
+    """
+    Content addressed cache of rendered frames, with least recently used
+    eviction once the total size of the cache exceeds maxSize.
+
+    Cache key is calculated from the code of the figure function, values of
+    variables it uses from closure and module globals (numbers, strings,
+    lists, dictionaries and numpy arrays), argument values, matplotlib
+    rcParams (including DPI) and compression settings. Changes in imported
+    modules or in data files read by the function are not detected; call
+    `clear()` in that case.
+
+    Attributes `hits` and `misses` count frames that were found in the
+    cache and frames that had to be rendered and stored.
+    """
+
+    framecache = os.path.join(mpl.get_cachedir(), 'frame.cache')
+
+    def __init__(self, cacheDir:str=None, maxSize:int=1024**3):
+        """
+        Args:
+            cacheDir (str, optional): directory where frames are stored.
+                By default `frame.cache` in matplotlib cache directory.
+            maxSize (int, optional): maximal total size of cached frames in
+                bytes. If `None`, cache size is not limited. Defaults to 1 GB.
+        """
+        self.cacheDir = cacheDir if cacheDir is not None else self.framecache
+        self.maxSize = maxSize
+        Path(self.cacheDir).mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def functionHash(self, function) -> str:
+        """Hash of the function code, and closure and global values it uses"""
+        h = hashlib.md5()
+        _hash_function(function, h, set())
+        return h.hexdigest()
+
+    def key(self, functionHash:str, kwargs:dict, settings:dict) -> str:
+        """Key under which frame rendered with given arguments is stored"""
+        params = sorted((k, v) for k, v in mpl.rcParams.items()
+                        if k not in _IGNORED_RCPARAMS)
+        s = ''.join([functionHash,
+                     repr(sorted(kwargs.items())),
+                     repr(sorted(settings.items())),
+                     repr(params)])
+        return hashlib.md5(s.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cacheDir, '%s.frame' % key)
+
+    def contains(self, key:str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def get(self, key:str):
+        """Returns cached frame, or None if there is no frame for the key"""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                frame = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        os.utime(path)  # mark as recently used
+        self.hits += 1
+        return frame
+
+    def put(self, key:str, frame):
+        """Stores newly rendered frame in the cache"""
+        self.misses += 1
+        # Write to temporary file in the cache directory and replace, so that
+        # other processes never see partially written frame.
+        with NamedTemporaryFile(dir=self.cacheDir, delete=False) as f:
+            pickle.dump(frame, f, protocol=4)
+        Path(f.name).replace(self._path(key))
+
+    def size(self) -> int:
+        """Total size of cached frames in bytes"""
+        return sum(entry.stat().st_size for entry in os.scandir(self.cacheDir)
+                   if entry.name.endswith(".frame"))
+
+    def evict(self):
+        """Removes least recently used frames until cache is within maxSize"""
+        if self.maxSize is None:
+            return
+        entries = [(entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                   for entry in os.scandir(self.cacheDir)
+                   if entry.name.endswith(".frame")]
+        total = sum(e[1] for e in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.maxSize:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            _log.debug('evicted %s from frame cache', path)
+
+    def clear(self):
+        """Removes all cached frames"""
+        for entry in os.scandir(self.cacheDir):
+            if entry.name.endswith(".frame"):
+                os.remove(entry.path)
+
+    def resetStatistics(self):
+        self.hits = 0
+        self.misses = 0
+
+
+def _save_npz(path, result):
+    """Saves numpy array, or tuple, list or dictionary of numpy arrays, as
+    npz file. Returns False for other results, that are not stored."""
+    if isinstance(result, np.ndarray):
+        arrays, kind = {"result": result}, "array"
+    elif (isinstance(result, (tuple, list))
+          and all(isinstance(a, np.ndarray) for a in result)):
+        arrays = {"arr_%d" % i: a for i, a in enumerate(result)}
+        kind = type(result).__name__
+    elif (isinstance(result, dict)
+          and all(isinstance(k, str) and isinstance(a, np.ndarray)
+                  for k, a in result.items())):
+        arrays, kind = dict(result), "dict"
+    else:
+        return False
+    if any(a.dtype == object for a in arrays.values()):
+        return False
+    arrays["__kind__"] = np.array(kind)
+    # Write to temporary file and replace, so that other processes never
+    # see partially written result.
+    with NamedTemporaryFile(dir=os.path.dirname(path), suffix=".npz",
+                            delete=False) as f:
+        np.savez(f, **arrays)
+    Path(f.name).replace(path)
+    return True
+
+
+def _load_npz(path):
+    """Loads result saved by _save_npz, or returns None if there is none"""
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            kind = str(data["__kind__"])
+            if kind == "array":
+                return data["result"]
+            if kind == "dict":
+                return {k: data[k] for k in data.files if k != "__kind__"}
+            arrays = [data["arr_%d" % i] for i in range(len(data.files) - 1)]
+            return tuple(arrays) if kind == "tuple" else arrays
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def memoize(arguments:list=None, maxSize:int=128, store=None):
+    """
+    Decorator that caches results of expensive calculations, e.g. solution
+    of equations that depends on `omega` and `detuning` but not on `time`
+    that is only used to select part of the solution for plotting.
+
+    Results are kept in memory, for up to maxSize last used combinations of
+    argument values. Optionally they are also stored on disk as numpy
+    `.npz` files, which are shared between worker processes and between
+    builds. Files are written atomically, so concurrent processes can safely
+    use the same store. Code of the function is part of the key, so
+    changing the function invalidates stored results.
+
+    Args:
+        arguments (list, optional): names of arguments that determine the
+            result. Other arguments are ignored when looking up the result.
+            By default all arguments are used.
+        maxSize (int, optional): maximal number of results kept in memory.
+            If `None`, number of results is not limited. Defaults to 128.
+        store (bool | str, optional): if `True`, results are also stored in
+            `memoize.cache` in matplotlib cache directory, or in the given
+            directory. Only numpy arrays, and tuples, lists and dictionaries
+            of numpy arrays are stored on disk. Defaults to None.
+
+    Returns:
+        Decorated function with `clearCache()` method that removes results
+        from memory and disk.
+
+    Example:
+        ```python
+        @memoize(["omega", "detuning"], store=True)
+        def solve(omega, detuning):
+            ...
+            return times, populations
+        ```
+    """
+    def decorator(function):
+        signature = inspect.signature(function)
+        for name in (arguments or []):
+            if name not in signature.parameters:
+                raise ValueError("%s is not an argument of %s"
+                                 % (name, function.__qualname__))
+        # files of different functions can be told apart in a shared store
+        prefix = re.sub(r"[^\w.]", "_", "%s.%s" % (function.__module__,
+                                                   function.__qualname__))
+        # hashed on the first call, when helper functions defined below the
+        # decorated function in its module already exist
+        functionHash = None
+        if store is True:
+            storeDir = os.path.join(mpl.get_cachedir(), "memoize.cache")
+        else:
+            storeDir = store
+        if storeDir is not None:
+            Path(storeDir).mkdir(parents=True, exist_ok=True)
+        results = OrderedDict()
+        lock = threading.Lock()
+
+        def key(args, kwargs):
+            nonlocal functionHash
+            if functionHash is None:
+                h = hashlib.md5(function.__qualname__.encode("utf-8"))
+                _hash_function(function, h, set())
+                functionHash = h.hexdigest()
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            names = arguments if arguments is not None else bound.arguments
+            k = hashlib.md5(functionHash.encode("utf-8"))
+            for name in sorted(names):
+                value = bound.arguments[name]
+                if isinstance(value, np.generic):
+                    value = value.item()  # same key for numpy and python numbers
+                k.update(name.encode("utf-8"))
+                try:
+                    k.update(_value_bytes(value))
+                except TypeError as error:
+                    raise TypeError("argument %s of %s can't be used in cache "
+                                    "key, select other arguments with "
+                                    "memoize([names])"
+                                    % (name, function.__qualname__)) from error
+            return k.hexdigest()
+
+        def path(k):
+            return os.path.join(storeDir, "%s-%s.npz" % (prefix, k))
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            k = key(args, kwargs)
+            with lock:
+                if k in results:
+                    results.move_to_end(k)
+                    return results[k]
+            result = None
+            if storeDir is not None:
+                result = _load_npz(path(k))
+            if result is None:
+                result = function(*args, **kwargs)
+                if storeDir is not None and not _save_npz(path(k), result):
+                    _log.debug('result of %s is not stored on disk',
+                               function.__qualname__)
+            with lock:
+                results[k] = result
+                if maxSize is not None:
+                    while len(results) > maxSize:
+                        results.popitem(last=False)
+            return result
+
+        def clearCache():
+            with lock:
+                results.clear()
+            if storeDir is not None:
+                for entry in os.scandir(storeDir):
+                    if (entry.name.startswith(prefix + "-")
+                            and entry.name.endswith(".npz")):
+                        os.remove(entry.path)
+
+        wrapper.clearCache = clearCache
+        wrapper._memoized = True
+        return wrapper
+
+    if callable(arguments):
+        raise ValueError("use memoize() or memoize([argument names]) as "
+                         "decorator")
+    return decorator
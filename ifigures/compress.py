@@ -0,0 +1,102 @@
+"""
+Quantization of png images with pngquant, and fitting of images in a given
+number of bytes, used for frames of interactive figures and for images of
+timelines.
+"""
+
+import shutil
+import subprocess
+from io import BytesIO
+
+from PIL import Image
+
+
+def pngquant(png_rep, quality=(40, 100), colors=256):
+    """Quantizes png with pngquant, repeating while that reduces size, and
+    falls back to Pillow's optimized png if pngquant doesn't reduce it.
+    Runs pngquant through pipes, without shared configuration and temporary
+    files, so it can be called from several threads at once."""
+    executable = shutil.which("pngquant") or "/usr/bin/pngquant"
+    command = [executable, "--quality=%d-%d" % quality, "--speed=3",
+               "--force", str(colors), "-"]
+    original, result = png_rep, None
+    while result is None or len(result) < len(png_rep):
+        if result is not None:
+            png_rep = result
+        try:
+            result = subprocess.run(command, input=png_rep,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.DEVNULL,
+                                    check=True).stdout
+        except subprocess.CalledProcessError:
+            # quality below minimum, pngquant leaves png unchanged
+            result = png_rep
+    if len(result) >= len(original):
+        png_rep, result = original, None
+        while result is None or len(result) < len(png_rep):
+            if result is not None:
+                png_rep = result
+            output = BytesIO()
+            Image.open(BytesIO(png_rep)).save(output, format="png",
+                                              optimize=True, quality=75)
+            result = output.getvalue()
+    return result if len(result) < len(original) else original
+
+
+# numbers of palette colours tried when fitting frames in size budget
+COLORS = (256, 192, 128, 96, 64, 48, 32, 24, 16, 12, 8, 6, 4, 2)
+# frames are downscaled rather than quantized to fewer colours than this
+MIN_COLORS = 16
+
+
+def scale_png(png_rep, scale):
+    """png resized by factor scale"""
+    if scale == 1:
+        return png_rep
+    image = Image.open(BytesIO(png_rep))
+    size = (max(1, round(image.size[0] * scale)),
+            max(1, round(image.size[1] * scale)))
+    png_output = BytesIO()
+    image.resize(size, Image.LANCZOS).save(png_output, format="png")
+    return png_output.getvalue()
+
+
+def fit_png(png_rep, maxBytes, downscale=False, quantized=None,
+            minColors=None):
+    """Quantizes png with pngquant to the largest number of colours (from
+    `COLORS`) at which it takes at most maxBytes. Fewer than `MIN_COLORS`
+    are used only if downscale is False, otherwise png is made smaller
+    instead. minColors can set the fewest colours used independently of
+    downscale. quantized can give png already quantized to some numbers of
+    colours. Returns (png, number of colours or None if png fits without
+    quantization, scale). If png can't fit, the smallest version is
+    returned."""
+    if len(png_rep) <= maxBytes:
+        return png_rep, None, 1.
+    original, scale = png_rep, 1.
+    if minColors is None:
+        minColors = MIN_COLORS if downscale else 0
+    colors = [c for c in COLORS if c >= minColors]
+    quantized = dict(quantized or {})
+    while True:
+        # binary search for the most colours that fit, size decreases
+        # with the number of colours
+        low, high = 0, len(colors) - 1
+        while low <= high:
+            middle = (low + high) // 2
+            c = colors[middle]
+            if c not in quantized:
+                quantized[c] = pngquant(png_rep, quality=(0, 100), colors=c)
+            if len(quantized[c]) <= maxBytes:
+                high = middle - 1
+            else:
+                low = middle + 1
+        if low < len(colors):
+            return quantized[colors[low]], colors[low], scale
+        smallest = quantized[colors[-1]]
+        if not downscale or min(Image.open(BytesIO(png_rep)).size) <= 16:
+            return smallest, colors[-1], scale
+        # number of bytes grows with number of pixels at most
+        scale *= 0.95 * (maxBytes / len(smallest))**0.5
+        png_rep = scale_png(original, scale)
+        quantized = {}
@@ -0,0 +1,142 @@
+"""
+Image encoders for frames of interactive figures.
+
+By default frames are saved with matplotlib's `print_png`. Encoder given
+to `InteractiveFigure.saveStandaloneHTML` instead takes the RGBA buffer of
+the Agg canvas directly (as numpy view, without copying it) and encodes it
+with Pillow, without metadata, in the chosen format. Frames are embedded
+with the matching MIME type.
+
+WebP and AVIF are usually several times smaller than png for frames with
+photographs, colour maps or smooth gradients. WebP is a core media type
+since EPUB 3.3, and is supported by current browsers; AVIF is supported by
+current browsers, but not by all e-readers.
+"""
+
+from io import BytesIO
+
+import numpy as np
+from PIL import Image, features
+
+
+class ImageEncoder(object):
+    """Base of image encoders. Subclasses set `mimeType` and `extension`,
+    and save Pillow image in `_save`."""
+
+    mimeType = "image/png"
+    extension = ".png"
+    # Pillow feature that has to be available, if any
+    _feature = None
+
+    def __init__(self, dropAlpha=True):
+        if self._feature is not None and not features.check(self._feature):
+            raise RuntimeError("%s needs Pillow with %s support"
+                               % (type(self).__name__, self._feature))
+        self.dropAlpha = dropAlpha
+
+    def encode(self, rgba:np.ndarray) -> bytes:
+        """Encodes image given as (height, width, 4) array of uint8 RGBA
+        values. If dropAlpha is True and the image is fully opaque, it is
+        saved without alpha channel."""
+        image = Image.frombuffer("RGBA", (rgba.shape[1], rgba.shape[0]),
+                                 np.ascontiguousarray(rgba), "raw", "RGBA", 0, 1)
+        if self.dropAlpha and rgba[:, :, 3].min() == 255:
+            image = image.convert("RGB")
+        output = BytesIO()
+        self._save(image, output)
+        return output.getvalue()
+
+    def _save(self, image, output):
+        raise NotImplementedError
+
+    def settings(self) -> dict:
+        """Settings that change encoded image (used in frame cache key)"""
+        settings = {"encoder": type(self).__name__}
+        settings.update(vars(self))
+        return settings
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__,
+                           ", ".join("%s=%r" % item for item in vars(self).items()))
+
+
+class PNGEncoder(ImageEncoder):
+    """Lossless png, at the given zlib compression level.
+
+    Args:
+        compressLevel (int, optional): zlib level from 0 (no compression,
+            fastest) to 9 (smallest). Matplotlib uses 6. Defaults to 6.
+        dropAlpha (bool, optional): save fully opaque frames without alpha
+            channel. Defaults to True.
+    """
+
+    mimeType = "image/png"
+    extension = ".png"
+
+    def __init__(self, compressLevel:int=6, dropAlpha:bool=True):
+        if compressLevel not in range(10):
+            raise ValueError("compressLevel should be between 0 and 9")
+        super().__init__(dropAlpha=dropAlpha)
+        self.compressLevel = compressLevel
+
+    def _save(self, image, output):
+        image.save(output, format="png", compress_level=self.compressLevel)
+
+
+class WebPEncoder(ImageEncoder):
+    """WebP, lossless or lossy.
+
+    Args:
+        lossless (bool, optional): Defaults to True.
+        quality (int, optional): for lossy encoding image quality from 0 to
+            100; for lossless encoding effort spent on making file smaller.
+            Defaults to 80.
+        method (int, optional): speed of encoding from 0 (fastest) to
+            6 (smallest file). Defaults to 4.
+        dropAlpha (bool, optional): save fully opaque frames without alpha
+            channel. Defaults to True.
+    """
+
+    mimeType = "image/webp"
+    extension = ".webp"
+    _feature = "webp"
+
+    def __init__(self, lossless:bool=True, quality:int=80, method:int=4,
+                 dropAlpha:bool=True):
+        if method not in range(7):
+            raise ValueError("method should be between 0 and 6")
+        super().__init__(dropAlpha=dropAlpha)
+        self.lossless = lossless
+        self.quality = quality
+        self.method = method
+
+    def _save(self, image, output):
+        image.save(output, format="webp", lossless=self.lossless,
+                   quality=self.quality, method=self.method)
+
+
+class AVIFEncoder(ImageEncoder):
+    """AVIF (lossy). Needs Pillow built with AVIF support.
+
+    Args:
+        quality (int, optional): image quality from 0 to 100. Defaults to 75.
+        speed (int, optional): speed of encoding from 0 (slowest, smallest
+            file) to 10 (fastest). Defaults to 6.
+        dropAlpha (bool, optional): save fully opaque frames without alpha
+            channel. Defaults to True.
+    """
+
+    mimeType = "image/avif"
+    extension = ".avif"
+    _feature = "avif"
+
+    def __init__(self, quality:int=75, speed:int=6, dropAlpha:bool=True):
+        if speed not in range(11):
+            raise ValueError("speed should be between 0 and 10")
+        super().__init__(dropAlpha=dropAlpha)
+        self.quality = quality
+        self.speed = speed
+
+    def _save(self, image, output):
+        image.save(output, format="avif", quality=self.quality,
+                   speed=self.speed)
@@ -1,8 +1,18 @@
-from collections import OrderedDict
+from collections import Counter, OrderedDict, deque
 from collections.abc import Callable
 from typing import List
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
 import itertools
 import base64
+import hashlib
+import inspect
+import json
+import os
+import re
+import sys
+import time
+import warnings
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
@@ -12,10 +22,12 @@ from html import escape
 
 from PIL import Image
 import numpy as np
-import pngquant
 
 from string import ascii_lowercase
 from .latex2png import latex2png
+from .cache import FrameCache
+from .compress import pngquant, scale_png, fit_png, COLORS, MIN_COLORS
+from .widgets import RangeWidget, RangeWidgetViridis
 
 import matplotlib as mpl
 mpl.rcParams['xtick.minor.visible'] = True
@@ -33,12 +45,50 @@ mpl.rcParams['font.family'] = 'serif'
 mpl.rcParams['axes.facecolor'] = 'None'
 mpl.rcParams['figure.facecolor']= 'None'
 
-def _get_png(obj, compress=False):
+# time spent in stages of frame rendering in this process, in seconds
+_stage_times = {}
+
+@contextmanager
+def _timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _stage_times[stage] = (_stage_times.get(stage, 0.)
+                               + time.perf_counter() - start)
+
+
+def _print_progress(done, total, record):
+    """Default progress report, works in terminal and in Jupyter"""
+    sys.stderr.write("\rRendered %d of %d frames" % (done, total))
+    if done == total:
+        sys.stderr.write("\n")
+    sys.stderr.flush()
+
+
+def _get_canvas(fig):
+    """Agg canvas of the figure, reused when figure is drawn repeatedly"""
+    if type(fig.canvas) is FigureCanvas:
+        return fig.canvas
+    return FigureCanvas(fig)
+
+
+def _rasterize(canvas, encoder=None):
+    """Image of the canvas, saved with matplotlib's png writer, or encoded
+    from the Agg RGBA buffer by encoder (see `encoders`)"""
+    with _timed("rasterize"):
+        if encoder is None:
+            png_output = BytesIO()
+            canvas.print_png(png_output)
+            return png_output.getvalue()
+        canvas.draw()
+        # view of Agg buffer, not a copy
+        return encoder.encode(np.asarray(canvas.buffer_rgba()))
+
+
+def _get_png(obj, compress=False, encoder=None):
     if isinstance(obj, mpl.figure.Figure):
-        canvas = FigureCanvas(obj)
-        png_output = BytesIO()
-        canvas.print_png(png_output)
-        png_rep = png_output.getvalue()
+        png_rep = _rasterize(_get_canvas(obj), encoder)
     else:
         # assume it's png
         png_rep = obj
@@ -46,27 +96,553 @@ def _get_png(obj, compress=False):
         if isinstance(obj, plt.Figure):
             plt.close(obj)  # keep from displaying twice
         if compress:
-            pngquant.config(min_quality=40, max_quality=100)
-            ratio, png_rep = pngquant.quant_data(png_rep)
+            png_rep = _compress(png_rep, compress)
     
     return png_rep
 
 
+def _quantize(png_rep):
+    with _timed("quantize"):
+        return pngquant(png_rep)
+
+
+def _compress(png_rep, compress):
+    """Quantizes png to shared palette if compress is `_Palette`, or
+    compresses it with pngquant otherwise"""
+    if isinstance(compress, _Palette):
+        with _timed("quantize"):
+            return compress.quantize(png_rep)
+    return _quantize(png_rep)
+
+
+class _Budget(object):
+    """Bytes of size budget left for frames that are not yet written.
+
+    Each frame gets share of bytes left in proportion to its size when
+    quantized to the planned number of colours, relative to expected size
+    of frames that follow. Expected size starts from the average size of
+    frames sampled when budget was planned, and is updated as frames are
+    fitted.
+
+    If downscale is True, frames are not quantized to fewer than
+    `MIN_COLORS` colours. All frames are downscaled by the same planned
+    scale, so that they are shown in the same size; frame that doesn't fit
+    in its share with `MIN_COLORS` takes more, and leaves less for the
+    following frames.
+
+    Identical frames are stored only once, so only unique frames are
+    fitted and share the budget. Their number among frames that follow is
+    estimated from the planned number of unique frames, updated with the
+    fraction of unique frames among frames already written."""
+
+    def __init__(self, bytesLeft, frames, frameBytes, colors=MIN_COLORS,
+                 scale=1., inline=True, downscale=False, unique=None):
+        self.bytesLeft = bytesLeft
+        self.framesLeft = frames
+        self.colors = colors
+        self.scale = scale
+        self.downscale = downscale
+        self.inline = inline
+        if unique is None:
+            unique = frames
+        # planned fraction of unique frames counts as five written frames
+        self._written = 5
+        self._unique = 5 * unique / max(1, frames)
+        # size with planned number of colours of frames not yet fitted
+        self._expected = frameBytes * unique
+        self._largest = frameBytes
+        # sampled frames count as five already fitted frames
+        self._fittedBytes, self._fitted = 5 * frameBytes, 5
+
+    def fit(self, png_rep, overhead=0, following=0):
+        """Compresses png (scaled by `scale`) to fit in its share of bytes
+        left, that is shared with the given number of following unique
+        frames, after overhead bytes of HTML around each frame left. Returns (png, number of colours or
+        None if not quantized)."""
+        png_rep = scale_png(png_rep, self.scale)
+        planned = pngquant(png_rep, quality=(0, 100), colors=self.colors)
+        self._largest = max(self._largest, len(planned))
+        average = self._fittedBytes / self._fitted
+        expected = min(max(self._expected - len(planned), following * average),
+                       following * self._largest)
+        # HTML around this and each following frame takes about overhead
+        available = self.bytesLeft - max(1, self.framesLeft) * overhead
+        share = available * len(planned) / (expected + len(planned))
+        if self.inline:
+            share = share * 3 / 4  # base64
+        self._expected = max(0, self._expected - len(planned))
+        self._fittedBytes += len(planned)
+        self._fitted += 1
+        png_rep, colors, scale = fit_png(
+            png_rep, share, quantized={self.colors: planned},
+            minColors=MIN_COLORS if self.downscale else None)
+        return png_rep, colors
+
+    def uniqueLeft(self):
+        """Expected number of unique frames among frames not yet written"""
+        return self.framesLeft * self._unique / self._written
+
+    def spend(self, nBytes, frames=0, unique=0):
+        """Records nBytes written for given number of frames, of which given
+        number are unique"""
+        self.bytesLeft -= nBytes
+        self.framesLeft -= frames
+        self._written += frames
+        self._unique += unique
+
+
+class _Palette(object):
+    """Palette of at most 256 RGBA colours, built from sample images, to
+    which frames are quantized. Frames quantized to the same palette keep
+    the same colours, so figure doesn't flicker when frames change.
+
+    Colours already seen are looked up instead of searched for again, so
+    quantization gets faster as more frames are processed."""
+
+    def __init__(self, images, colors=256):
+        pixels = np.concatenate([image.reshape(-1, 4) for image in images])
+        # sample at most about million pixels
+        pixels = pixels[::max(1, len(pixels) // 1000000)]
+        # Pillow's octree quantizer supports alpha channel
+        sample = Image.fromarray(np.ascontiguousarray(pixels).reshape(-1, 1, 4),
+                                 "RGBA")
+        quantized = sample.quantize(colors, method=Image.Quantize.FASTOCTREE)
+        used = int(np.asarray(quantized).max()) + 1
+        self.colors = np.array(quantized.getpalette("RGBA")[:4 * used],
+                               dtype=np.uint8).reshape(-1, 4)
+        if (pixels[:, 3] == 0).any() and (self.colors[:, 3] > 0).all():
+            # fully transparent background must stay transparent
+            self.colors = np.vstack([self.colors[:colors - 1],
+                                     np.zeros((1, 4), dtype=np.uint8)])
+        self.digest = hashlib.md5(self.colors.tobytes()).hexdigest()
+        # colours (as 32 bit integers, sorted) and their palette indices
+        self._known = np.zeros(0, dtype=np.uint32)
+        self._index = np.zeros(0, dtype=np.uint8)
+
+    def _nearest(self, colors):
+        """Palette indices of colours closest to given RGBA 32 bit colours"""
+        rgba = colors.view(np.uint8).reshape(-1, 4).astype(np.int32)
+        palette = self.colors.astype(np.int32)
+        index = np.empty(len(rgba), dtype=np.uint8)
+        for start in range(0, len(rgba), 4096):
+            chunk = rgba[start:start + 4096]
+            # colour of transparent pixel doesn't matter
+            weight = np.minimum(chunk[:, None, 3:], palette[None, :, 3:]) / 255
+            difference = chunk[:, None, :] - palette[None, :, :]
+            distance = ((difference[:, :, :3]**2 * weight).sum(axis=2)
+                        + difference[:, :, 3]**2)
+            index[start:start + len(chunk)] = distance.argmin(axis=1)
+        return index
+
+    def quantize(self, png_rep):
+        """Returns png_rep as indexed png with this palette"""
+        rgba = np.asarray(Image.open(BytesIO(png_rep)).convert("RGBA"))
+        colors = np.ascontiguousarray(rgba).view(np.uint32).ravel()
+        position = np.searchsorted(self._known, colors)
+        position[position == len(self._known)] = 0
+        found = (self._known[position] == colors) if len(self._known) else \
+            np.zeros(len(colors), dtype=bool)
+        if not found.all():
+            new = np.unique(colors[~found])
+            known = np.concatenate([self._known, new])
+            order = known.argsort()
+            self._known = known[order]
+            self._index = np.concatenate([self._index,
+                                          self._nearest(new)])[order]
+            position = np.searchsorted(self._known, colors)
+        indexed = Image.fromarray(self._index[position].reshape(rgba.shape[:2]),
+                                  "P")
+        indexed.putpalette(self.colors[:, :3].tobytes())
+        png_output = BytesIO()
+        indexed.save(png_output, format="png", optimize=True,
+                     transparency=self.colors[:, 3].tobytes())
+        return png_output.getvalue()
+
+
+def _map_pngs(function, frames):
+    """Applies function to png images of rendered frames (see
+    `_render_unit`), leaving captions unchanged"""
+    return [tuple(function(part) if i != 1 and part is not None else part
+                  for i, part in enumerate(frame))
+            for frame in frames]
+
+
+def _frame_images(frames):
+    """RGBA arrays of png images of rendered frames"""
+    return [np.asarray(Image.open(BytesIO(png)).convert("RGBA"))
+            for frame in frames for png in frame[::2] if png is not None]
+
+
+def _content_box(pngs):
+    """Union of bounding boxes of content of png images, as (left, top,
+    right, bottom), or None if images have different sizes or no margins.
+    Margins are rows and columns of background colour, that is the colour
+    of all four corners (any fully transparent colour for transparent
+    corners). Images whose corners differ have no margins."""
+    size = rows = columns = None
+    for png_rep in pngs:
+        rgba = np.asarray(Image.open(BytesIO(png_rep)).convert("RGBA"))
+        if size is None:
+            size = rgba.shape[:2]
+            rows = np.zeros(size[0], dtype=bool)
+            columns = np.zeros(size[1], dtype=bool)
+        elif rgba.shape[:2] != size:
+            return None
+        corners = rgba[[0, 0, -1, -1], [0, -1, 0, -1]]
+        if (corners[:, 3] == 0).all():
+            content = rgba[:, :, 3] != 0
+        elif (corners == corners[0]).all():
+            content = (rgba != corners[0]).any(axis=2)
+        else:
+            return None
+        rows |= content.any(axis=1)
+        columns |= content.any(axis=0)
+    if size is None or not rows.any():
+        return None
+    top, bottom = np.flatnonzero(rows)[[0, -1]]
+    left, right = np.flatnonzero(columns)[[0, -1]]
+    if (left, top, right + 1, bottom + 1) == (0, 0, size[1], size[0]):
+        return None
+    return int(left), int(top), int(right) + 1, int(bottom) + 1
+
+
+def _crop_png(png_rep, box, encoder=None):
+    """png cropped to box (left, top, right, bottom). Images that are not
+    png are decoded and encoded again by encoder. Palette and transparency
+    of quantized png are kept."""
+    return _crop_image(Image.open(BytesIO(png_rep)), box, encoder)
+
+
+def _crop_image(image, box, encoder=None):
+    """Part of Pillow image in box (left, top, right, bottom), encoded as
+    png or by encoder (see `_crop_png`). Palette of cropped indexed image
+    keeps only colours that it uses."""
+    if encoder is not None and encoder.mimeType != "image/png":
+        left, top, right, bottom = box
+        rgba = np.asarray(image.convert("RGBA"))
+        return encoder.encode(rgba[top:bottom, left:right])
+    cropped = image.crop(box)
+    options = {}
+    if image.mode == "P":
+        used, indices = np.unique(np.asarray(cropped), return_inverse=True)
+        palette = np.array(image.getpalette(), dtype=np.uint8).reshape(-1, 3)
+        cropped = Image.fromarray(indices.reshape(cropped.size[::-1])
+                                  .astype(np.uint8), "P")
+        cropped.putpalette(palette[used].tobytes())
+        transparency = image.info.get("transparency")
+        if isinstance(transparency, bytes):
+            alpha = np.full(len(palette), 255, dtype=np.uint8)
+            alpha[:len(transparency)] = np.frombuffer(transparency,
+                                                      dtype=np.uint8)
+            if (alpha[used] < 255).any():
+                options["transparency"] = alpha[used].tobytes()
+        elif transparency is not None and transparency in used:
+            options["transparency"] = int(np.searchsorted(used, transparency))
+    png_output = BytesIO()
+    cropped.save(png_output, format="png", optimize=image.mode == "P",
+                 compress_level=getattr(encoder, "compressLevel", 6), **options)
+    return png_output.getvalue()
+
+
+def _quantize_frames(frames, times):
+    """Quantizes png images of rendered frames (see `_render_unit`), adding
+    the time spent to times. Runs in a thread of the compression stage."""
+    start = time.perf_counter()
+    frames = _map_pngs(pngquant, frames)
+    times["quantize"] = (times.get("quantize", 0.)
+                         + time.perf_counter() - start)
+    return frames, times
+
+
+def _pipeline(rendered, stage, threads):
+    """Applies stage to each item of rendered in a pool of threads, while
+    the next items are rendered. At most 2 * threads items wait for or are
+    in the stage (back pressure), so the main thread does not run ahead.
+    Yields results in the original order."""
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        try:
+            for item in rendered:
+                pending.append(pool.submit(stage, *item))
+                if len(pending) >= 2 * threads:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _hide_static(artist, changed):
+    """Hides all artists except animated ones and their parents (figure,
+    axes), and marks animated artists for drawing. Changed artists are
+    appended to changed. Returns True if artist is or contains animated
+    artist."""
+    if artist.get_animated():
+        artist.set_animated(False)
+        changed.append((artist, "animated"))
+        return True
+    # all children are visited, so that every static child is hidden
+    dynamic = [_hide_static(child, changed) for child in artist.get_children()]
+    if any(dynamic):
+        return True
+    if artist.get_visible():
+        artist.set_visible(False)
+        changed.append((artist, "visible"))
+    return False
+
+
+def _get_layer_pngs(obj, compress=False, static=True, encoder=None):
+    """Renders artists marked with `set_animated(True)` as transparent
+    overlay, and (if static is True) the rest of the figure as static layer.
+    Returns (overlay png, static png or None)."""
+    if not isinstance(obj, mpl.figure.Figure):
+        return _get_png(obj, compress=compress, encoder=encoder), None
+    static_rep = None
+    if static:
+        # Agg canvas doesn't draw animated artists
+        static_rep = _rasterize(_get_canvas(obj), encoder)
+        if compress:
+            static_rep = _compress(static_rep, compress)
+    changed = []
+    _hide_static(obj, changed)
+    png_rep = _get_png(obj, compress=compress, encoder=encoder)
+    # figure can be reused for the next frame (see UpdatingFigure)
+    for artist, prop in changed:
+        if prop == "animated":
+            artist.set_animated(True)
+        else:
+            artist.set_visible(True)
+    return png_rep, static_rep
+
+
+def _side_by_side(images):
+    """Image with the given images next to each other, aligned at the top,
+    on transparent background"""
+    if len(images) == 1:
+        return images[0]
+    images = [image.convert("RGBA") for image in images]
+    combined = Image.new("RGBA", (sum(image.size[0] for image in images),
+                                  max(image.size[1] for image in images)),
+                         (255, 255, 255, 0))
+    x = 0
+    for image in images:
+        combined.paste(image, (x, 0))
+        x += image.size[0]
+    return combined
+
 def _get_html(obj, compress=False):
     """Get the HTML representation of an object"""
+    return _png_html(_get_png(obj, compress=compress), obj)
 
-    png_rep = _get_png(obj, compress=compress)
+def _data_uri(png_rep, mimeType="image/png"):
+    """Data URI of image"""
+    return "data:{0};base64,{1}".format(mimeType,
+                                        base64.b64encode(png_rep).decode("utf-8"))
 
+def _png_html(png_rep, obj=None, imgId=None, mimeType="image/png"):
+    """Get the HTML representation of png (or object if png_rep is None)"""
     if png_rep is not None:
-        return ('<img alt="figure" src="data:image/png;'
-                'base64,{0}"/>'.format(base64.b64encode(png_rep).decode("utf-8") ))
+        idAttribute = ' id="{0}"'.format(imgId) if imgId is not None else ''
+        return '<img alt="figure"{0} src="{1}"/>'.format(
+            idAttribute, _data_uri(png_rep, mimeType))
     else:
         return "<p> {0} </p>".format(str(obj))
 
-def _eformat(f, prec, exp_digits):
-    s = "%.*e"%(prec, f)
-    mantissa, exp = s.split('e')
-    return "%se%+0*d"%(mantissa, exp_digits+1, int(exp))
+def _png_reference_html(imgId):
+    """Get the HTML of the image identical to already embedded image imgId.
+    Source is copied by javascript once the frame is displayed."""
+    return '<img alt="figure" data-frame="{0}"/>'.format(imgId)
+
+def _png_file_html(url):
+    """Get the HTML representation of png stored in separate file. Browser
+    fetches the file only once the frame is displayed."""
+    return '<img alt="figure" loading="lazy" src="{0}"/>'.format(escape(url))
+
+def _js_string(s):
+    """String literal that can be safely used inside HTML script element"""
+    return json.dumps(s).replace("</", "<\\/")
+
+def _init_worker(rcParams):
+    """Worker process initializer: reproduce parent matplotlib settings"""
+    mpl.rcParams.update(rcParams)
+
+def _render_frame(function, kwargs, compress=False, layers=False, static=False,
+                  encoder=None):
+    """Calls figure function for one combination of input values and returns
+    (png, caption). Module level so it can be sent to worker processes.
+
+    If layers is True, png contains only animated artists, and
+    (png, caption, static png or None) is returned. If encoder is given,
+    images are in its format instead of png."""
+    with _timed("function"):
+        figure = function(**kwargs)
+    return _encode_frame(figure, compress=compress, layers=layers,
+                         static=static, encoder=encoder)
+
+def _encode_frame(figure, compress=False, layers=False, static=False,
+                  encoder=None):
+    """(png, caption) or, in layers mode, (png, caption, static png or None)
+    of (figure, caption) returned by figure function"""
+    if layers:
+        overlay, static_rep = _get_layer_pngs(figure[0], compress=compress,
+                                              static=static, encoder=encoder)
+        return overlay, figure[1], static_rep
+    return _get_png(figure[0], compress=compress, encoder=encoder), figure[1]
+
+def _render_sweep(function, sweep, kwargs, compress=False, layers=False,
+                  static=(), encoder=None):
+    """Calls generator or batch figure function once for frames that differ
+    only in the value of the swept input, and returns their list.
+
+    sweep is the name of the swept input; function gets array of its
+    values from kwargs (in increasing order) and yields or returns list of
+    (figure, caption) for each of them."""
+    arguments = {k: v for k, v in kwargs[0].items() if k != sweep}
+    arguments[sweep] = np.array([k[sweep] for k in kwargs])
+    with _timed("function"):
+        figures = function(**arguments)
+        iterator = iter(figures)
+    frames = []
+    try:
+        for st in static:
+            # generator runs its calculation when the next figure is taken
+            with _timed("function"):
+                figure = next(iterator, None)
+            if figure is None:
+                break
+            frames.append(_encode_frame(figure, compress=compress,
+                                        layers=layers, static=st,
+                                        encoder=encoder))
+    finally:
+        if inspect.isgenerator(figures):
+            figures.close()
+    if len(frames) < len(kwargs):
+        raise ValueError("%s gave %d figures for %d values of %s"
+                         % (function.__name__, len(frames), len(kwargs), sweep))
+    return frames
+
+def _render_unit(function, sweep, kwargs, compress=False, layers=False,
+                 static=(), encoder=None):
+    """List of frames for kwargs, rendered by one call of figure function
+    for generator functions, or by one call per frame otherwise. Returns
+    (frames, time spent in each stage of rendering)."""
+    _stage_times.clear()
+    if sweep is not None:
+        frames = _render_sweep(function, sweep, kwargs, compress=compress,
+                               layers=layers, static=static, encoder=encoder)
+    else:
+        frames = [_render_frame(function, k, compress=compress, layers=layers,
+                                static=st, encoder=encoder)
+                  for k, st in zip(kwargs, static)]
+    return frames, dict(_stage_times)
+
+def batch(inputName:str):
+    """Decorator for figure functions that render frames for many values of
+    one input at once (e.g. using numpy broadcasting). Decorated function
+    gets array of values of inputName, and returns list of
+    (figure, caption), one for each value.
+
+    Args:
+        inputName (str): name of the input whose values are passed as array.
+
+    Example:
+        ```python
+        @batch("omega")
+        def plot(omega, amplitude):
+            y = amplitude * np.sin(np.outer(omega, x))  # all omegas at once
+            frames = []
+            for w, yw in zip(omega, y):
+                fig, ax = plt.subplots()
+                ax.plot(x, yw)
+                frames.append((fig, "omega = %.2f" % w))
+            return frames
+        ```
+    """
+    def decorator(function):
+        function.batchInput = inputName
+        return function
+    return decorator
+
+def _unique_frames(count, digests):
+    """Estimated number of unique frames among count frames, from digests
+    of frames sampled from them (Chao1 estimator, bias corrected). If no
+    sampled frame repeats, all frames are assumed to be unique."""
+    repeats = Counter(Counter(digests).values())
+    unique = len(set(digests))
+    if repeats[1] == unique:
+        return count
+    estimate = unique + repeats[1] * (repeats[1] - 1) / (2 * (repeats[2] + 1))
+    return min(count, estimate)
+
+def _base36(n):
+    """Same as javascript n.toString(36) for non-negative integers"""
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    s = ""
+    while True:
+        n, d = divmod(n, 36)
+        s = digits[d] + s
+        if n == 0:
+            return s
+
+def _frame_id(index, prefix=""):
+    """div id of the frame with given index, same as frameId() in javascript"""
+    return prefix + "f" + _base36(index)
+
+
+class UpdatingFigure(object):
+    """
+    Figure function that creates figure only once, and then for each
+    combination of input values only updates data of its artists. This
+    avoids repeated figure creation, layout and tick computation, which
+    dominate rendering time of simple plots with many frames.
+
+    Can be used instead of figure function in
+    [InteractiveFigure](#ifigures.InteractiveFigure).
+    """
+    def __init__(self, setup:Callable[[], plt.figure],
+                 update:Callable[..., str]):
+        """
+        Args:
+            setup (Callable[[], plt.figure]): function without arguments that
+                creates and returns the figure.
+            update (Callable[..., str]): function that is called as
+                `update(figure, **kwargs)` with input values, changes
+                artists of the figure (e.g. with `line.set_ydata`) and
+                returns caption.
+        """
+        self.setup = setup
+        self.update = update
+        self._figure = None
+
+    def __call__(self, **kwargs):
+        if self._figure is None:
+            self._figure = self.setup()
+        caption = self.update(self._figure, **kwargs)
+        return self._figure, caption
+
+    def __getstate__(self):
+        # worker processes set up their own figure
+        state = self.__dict__.copy()
+        state["_figure"] = None
+        return state
+
+
+class _Panel(object):
+    """Part of the interactive figure drawn by one function, that depends
+    only on some of the figure inputs"""
+    def __init__(self, name, function, dependencies):
+        self.name = name
+        self.function = function
+        self.dependencies = dependencies
+        # prefix of element ids, so that panels don't clash
+        self.prefix = name + "-" if name else ""
+        # input swept by generator function
+        self.sweep = None
+
+    def widgets(self, widgets):
+        return OrderedDict((name, widget) for name, widget in widgets.items()
+                           if name in self.dependencies)
 
 class InteractiveFigure(object):
 
@@ -158,6 +734,18 @@ div.wrap{
 display:inline-block;
 max-width:100%;
 }
+div.ifigurepanel{
+display:inline-block;
+vertical-align:top;
+max-width:100%;
+}
+div.ifigurelayers{
+display:grid;
+}
+div.ifigurelayers > *{
+grid-area:1 / 1;
+align-self:start;
+}
 
 img{
     max-width:100%;
@@ -306,41 +894,102 @@ input[type=range].viridisrange::-webkit-slider-runnable-track {
      <title>Interactive figure</title>
 
     <script type="text/javascript">
-      var mergeNodes = function(a, b) {{
-        return [].slice.call(a).concat([].slice.call(b));
-      }}; // http://stackoverflow.com/questions/914783/javascript-nodelist/17262552#17262552
-      function interactUpdate(div){{
-         div = div.parentNode.parentNode;
-         var outputs = document.getElementById("outputs").children;
-
-         //var controls = div.getElementsByTagName("input");
-         var controls = mergeNodes(div.getElementsByTagName("input"), div.getElementsByTagName("select"));
-         function nameCompare(a,b) {{
-            return a.getAttribute("name").localeCompare(b.getAttribute("name"));
+      // framePanels lists independent panels of the figure; for each,
+      // widgets it depends on are given in the order of the frames, with
+      // number of values for each; frame index is mixed-radix number whose
+      // digits are indices of selected widget values
+      var framePanels = {frame_panels};
+      var pendingUpdate = false;
+      // if only some combinations are rendered, closest one is shown
+      for(var p=0; p<framePanels.length; p++){{
+        var panel = framePanels[p];
+        panel.renderedFrames = {{}};
+        if(panel.rendered){{
+          for(var i=0; i<panel.rendered.length; i++){{
+            panel.renderedFrames[panel.rendered[i]] = true;
+          }}
+        }}
+      }}
+      function valueIndex(name){{
+         var controls = document.getElementsByName(name);
+         if(controls[0].type == "range"){{
+           return Math.round((parseFloat(controls[0].value) - parseFloat(controls[0].min))
+                             / parseFloat(controls[0].step));
+         }}
+         if(controls[0].type == "select-one"){{
+           return controls[0].selectedIndex;
+         }}
+         for(var j=0; j<controls.length; j++){{
+           if(controls[j].checked){{
+             return j;
+           }}
+         }}
+         return 0;
+      }}
+      function frameIndex(panel){{
+         var index = 0;
+         var digits = [];
+         for(var w=0; w<panel.widgets.length; w++){{
+           digits.push(valueIndex(panel.widgets[w][0]));
+           index = index * panel.widgets[w][1] + digits[w];
+         }}
+         if(panel.rendered && !panel.renderedFrames[index]){{
+           index = nearestFrame(panel, digits);
          }}
-         controls.sort(nameCompare);
-         var value = "";
-         for(i=0; i<controls.length; i++){{
-           if((controls[i].type == "range") || controls[i].checked){{
-             var controlValue = controls[i].value;
-             if (!isNaN(parseFloat(controlValue))){{
-                 controlValue = parseFloat(controlValue).toExponential(6);
+         return index;
+      }}
+      function nearestFrame(panel, digits){{
+         // distance along sliders is measured as fraction of the range,
+         // and other inputs count 1 if they differ
+         var ordered = [];
+         for(var w=0; w<panel.widgets.length; w++){{
+           ordered.push(document.getElementsByName(panel.widgets[w][0])[0].type == "range");
+         }}
+         var best = panel.current;
+         var bestDistance = Infinity;
+         for(var i=0; i<panel.rendered.length; i++){{
+           var index = panel.rendered[i];
+           var distance = 0;
+           for(var w=panel.widgets.length-1; w>=0; w--){{
+             var count = panel.widgets[w][1];
+             var digit = index % count;
+             if(ordered[w]){{
+               distance += Math.abs(digit - digits[w]) / Math.max(1, count - 1);
+             }} else if(digit != digits[w]){{
+               distance += 1;
              }}
-             value = value + controls[i].getAttribute("name") + controlValue;
+             index = Math.floor(index / count);
            }}
-           if(controls[i].type == "select-one"){{
-             value = value + controls[i].getAttribute("name") + controls[i][controls[i].selectedIndex].value;
+           if(distance < bestDistance){{
+             best = panel.rendered[i];
+             bestDistance = distance;
            }}
          }}
-         for(i=0; i<outputs.length; i++){{
-           var name = outputs[i].getAttribute("id");
-           if(name == value){{
-              outputs[i].style.display = 'block';
-           }} else if(name != "controls"){{
-              outputs[i].style.display = 'none';
-           }}
+         return best;
+      }}
+      function frameId(panel, index){{
+         return panel.prefix + "f" + index.toString(36);
+      }}
+      function updatePanels(){{
+         for(var p=0; p<framePanels.length; p++){{
+           showFrame(framePanels[p], frameIndex(framePanels[p]));
          }}
       }}
+      function interactUpdate(div){{
+         // while slider is moving, update at most once per animation frame
+         if(!window.requestAnimationFrame){{
+           updatePanels();
+           return;
+         }}
+         if(!pendingUpdate){{
+           pendingUpdate = true;
+           window.requestAnimationFrame(function(){{
+             pendingUpdate = false;
+             updatePanels();
+           }});
+         }}
+      }}
+{display_script}
       window.addEventListener("load", fitWindow);
       window.addEventListener("resize", fitWindow);
       function fitWindow(){{
@@ -367,6 +1016,260 @@ input[type=range].viridisrange::-webkit-slider-runnable-track {
     </body>
     """
 
+    frames_script = """
+      function showFrame(panel, index){
+         // only previously and newly visible frames are touched
+         if(index == panel.current){
+           return;
+         }
+         var previous = document.getElementById(frameId(panel, panel.current));
+         var output = document.getElementById(frameId(panel, index));
+         if(previous){
+           previous.style.display = 'none';
+         }
+         if(output){
+           loadFrame(output);
+           output.style.display = 'block';
+         }
+         panel.current = index;
+      }
+      function loadFrame(output){
+         // identical images are stored only once, other frames reference them
+         var images = output.querySelectorAll("img[data-frame]");
+         for(var j=0; j<images.length; j++){
+           if(!images[j].hasAttribute("src")){
+             images[j].src = document.getElementById(images[j].getAttribute("data-frame")).src;
+           }
+         }
+      }
+      window.addEventListener("DOMContentLoaded", function(){
+         for(var p=0; p<framePanels.length; p++){
+           var output = document.getElementById(frameId(framePanels[p], framePanels[p].current));
+           if(output){
+             loadFrame(output);
+           }
+         }
+      });
+    """
+
+    viewer_script = """
+      // each panel is shown in a single img element, whose source is
+      // changed on update; neighbouring frames are decoded in advance
+      var viewerImages = [];
+      for(var p=0; p<framePanels.length; p++){
+        framePanels[p].frames = {};
+        framePanels[p].prefetched = [];
+      }
+      function addImage(src){
+         viewerImages.push(src);
+      }
+      function addFrame(panel, index, image, caption){
+         framePanels[panel].frames[index] = [image, caption];
+      }
+      function setStatic(panel, src){
+         var layer = document.getElementById(framePanels[panel].prefix + "static");
+         layer.src = src;
+         layer.style.display = 'block';
+      }
+      function prefetch(panel, index){
+         var images = [];
+         var stride = 1;
+         for(var w=panel.widgets.length-1; w>=0; w--){
+           var count = panel.widgets[w][1];
+           var digit = Math.floor(index / stride) % count;
+           var neighbours = [];
+           if(digit > 0){ neighbours.push(index - stride); }
+           if(digit < count - 1){ neighbours.push(index + stride); }
+           for(var j=0; j<neighbours.length; j++){
+             var frame = panel.frames[neighbours[j]];
+             if(frame && frame[0] >= 0){
+               var img = new Image();
+               img.src = viewerImages[frame[0]];
+               if(img.decode){
+                 img.decode().catch(function(){});
+               }
+               images.push(img);
+             }
+           }
+           stride *= count;
+         }
+         panel.prefetched = images; // keep references until the next update
+      }
+      function showFrame(panel, index){
+         var viewer = document.getElementById(panel.prefix + "viewer");
+         var frame = panel.frames[index];
+         if(frame){
+           if(frame[0] >= 0){
+             viewer.src = viewerImages[frame[0]];
+             viewer.style.display = 'block';
+           } else {
+             viewer.style.display = 'none';
+           }
+           document.getElementById(panel.prefix + "viewercaption").innerHTML = frame[1];
+         }
+         panel.current = index;
+         prefetch(panel, index);
+      }
+      window.addEventListener("DOMContentLoaded", function(){
+         for(var p=0; p<framePanels.length; p++){
+           showFrame(framePanels[p], framePanels[p].current);
+         }
+      });
+    """
+
+    tiles_script = """
+      // each panel is drawn on a canvas from square tiles; every distinct
+      // tile is stored once and shared by frames, and only tiles that
+      // differ from the drawn frame are redrawn on update
+      var tileSources = [];
+      var tileImages = [];
+      for(var p=0; p<framePanels.length; p++){
+        framePanels[p].frames = {};
+        framePanels[p].drawn = null;
+      }
+      function addTile(src){
+         tileSources.push(src);
+      }
+      function addFrame(panel, index, tiles, caption){
+         // tiles is [width, height, tile size, tile numbers by rows]
+         // (-1 for transparent tile), or -1 if frame has no image
+         framePanels[panel].frames[index] = [tiles, caption];
+      }
+      function setStatic(panel, src){
+         var layer = document.getElementById(framePanels[panel].prefix + "static");
+         layer.src = src;
+         layer.style.display = 'block';
+      }
+      function tileImage(t){
+         if(!tileImages[t]){
+           var img = new Image();
+           img.src = tileSources[t];
+           tileImages[t] = img;
+         }
+         return tileImages[t];
+      }
+      function loadTiles(tiles){
+         // returns true if all tiles are decoded
+         var complete = true;
+         for(var k=0; k<tiles[3].length; k++){
+           if(tiles[3][k] >= 0 && !tileImage(tiles[3][k]).complete){
+             complete = false;
+           }
+         }
+         return complete;
+      }
+      function prefetch(panel, index){
+         var stride = 1;
+         for(var w=panel.widgets.length-1; w>=0; w--){
+           var count = panel.widgets[w][1];
+           var digit = Math.floor(index / stride) % count;
+           var neighbours = [];
+           if(digit > 0){ neighbours.push(index - stride); }
+           if(digit < count - 1){ neighbours.push(index + stride); }
+           for(var j=0; j<neighbours.length; j++){
+             var frame = panel.frames[neighbours[j]];
+             if(frame && frame[0] != -1){
+               loadTiles(frame[0]);
+             }
+           }
+           stride *= count;
+         }
+      }
+      function drawTiles(panel, index){
+         var frame = panel.frames[index];
+         if(panel.current != index || !frame || frame[0] == -1){
+           return;
+         }
+         var tiles = frame[0];
+         if(!loadTiles(tiles)){
+           // try again once the missing tiles are decoded
+           for(var k=0; k<tiles[3].length; k++){
+             var img = tiles[3][k] >= 0 ? tileImage(tiles[3][k]) : null;
+             if(img && !img.complete){
+               img.addEventListener("load", function(){ drawTiles(panel, index); });
+               return;
+             }
+           }
+         }
+         var canvas = document.getElementById(panel.prefix + "viewer");
+         var drawn = panel.drawn;
+         if(canvas.width != tiles[0] || canvas.height != tiles[1]){
+           canvas.width = tiles[0];
+           canvas.height = tiles[1];
+           drawn = null;
+         }
+         var context = canvas.getContext("2d");
+         var size = tiles[2];
+         var columns = Math.ceil(tiles[0] / size);
+         for(var k=0; k<tiles[3].length; k++){
+           if(drawn && drawn[3][k] == tiles[3][k]){
+             continue;
+           }
+           var x = (k % columns) * size;
+           var y = Math.floor(k / columns) * size;
+           context.clearRect(x, y, size, size);
+           if(tiles[3][k] >= 0){
+             context.drawImage(tileImage(tiles[3][k]), x, y);
+           }
+         }
+         panel.drawn = tiles;
+      }
+      function showFrame(panel, index){
+         var canvas = document.getElementById(panel.prefix + "viewer");
+         var frame = panel.frames[index];
+         panel.current = index;
+         if(frame){
+           if(frame[0] != -1){
+             canvas.style.display = 'block';
+             drawTiles(panel, index);
+           } else {
+             canvas.style.display = 'none';
+           }
+           document.getElementById(panel.prefix + "viewercaption").innerHTML = frame[1];
+         }
+         prefetch(panel, index);
+      }
+      window.addEventListener("DOMContentLoaded", function(){
+         for(var p=0; p<framePanels.length; p++){
+           showFrame(framePanels[p], framePanels[p].current);
+         }
+      });
+    """
+
+    tiles_template = """
+    <div class="ifigurelayers">
+    <img id="{prefix}static" class="ifigurestatic" alt="figure" style="display:none"/>
+    <canvas id="{prefix}viewer" style="max-width:100%;height:auto"></canvas>
+    </div>
+    <div class="ifigurecaption" id="{prefix}viewercaption"></div>
+    <script type="text/javascript">
+    {{frames}}
+    </script>
+    """
+
+    viewer_template = """
+    <div class="ifigurelayers">
+    <img id="{prefix}static" class="ifigurestatic" alt="figure" style="display:none"/>
+    <img id="{prefix}viewer" alt="figure"/>
+    </div>
+    <div class="ifigurecaption" id="{prefix}viewercaption"></div>
+    <script type="text/javascript">
+    {{frames}}
+    </script>
+    """
+
+    layers_template = """
+    <div class="ifigurelayers">
+    {frames}
+    </div>
+    """
+
+    panel_template = """
+    <div class="ifigurepanel" id="{name}">
+    {{frames}}
+    </div>
+    """
+
     subdiv_template = """
     <div id="{name}" style="display:{display}">
       {content}
@@ -376,21 +1279,26 @@ input[type=range].viridisrange::-webkit-slider-runnable-track {
     </div>
     """
 
-    @staticmethod
-    def _get_strrep(val):
-        """Need to match javascript string rep"""
-        # TODO: is there a better way to do this?
-        if isinstance(val, str):
-            return val
-        else:
-            return _eformat(val, 6, 1)
-
     def __init__(self, function:Callable[..., (plt.figure, str)], **kwargs):
         """Interactive Figure Object
 
         Args:
             function (Callable[...,(plt.figure, str)]): Callable function that returns matplotlib figure and caption
-                and accepts same arguments as kwargs defined through Interactive Figure Input Controls
+                and accepts same arguments as kwargs defined through Interactive Figure Input Controls.
+                For figures that only change data of their artists use
+                [UpdatingFigure](#ifigures.UpdatingFigure).
+                Function can also be a generator that sweeps the only
+                RangeWidgetViridis input (e.g. time): it gets array of
+                its values in increasing order, and yields (figure, caption)
+                for each of them, so that a simulation runs once for each
+                combination of other inputs. Functions decorated with
+                [batch](#ifigures.batch) similarly return list of frames for
+                array of values of one input.
+                Alternatively, dictionary `{panelName: function}` of independent panels,
+                shown next to each other, each with its own caption. Each panel
+                function accepts only inputs that it depends on (or
+                panel can be given as `(function, [inputNames])`), and is
+                rendered only for combinations of values of these inputs.
             kwargs: keyword arguments that accept Interactive Figure input controls
         """
         # TODO: implement *args (difficult because of the name thing)
@@ -400,60 +1308,1236 @@ input[type=range].viridisrange::-webkit-slider-runnable-track {
 
         self.widgets = OrderedDict(kwargs)
         self.function = function
+        self.panels = self._make_panels(function)
+        self._find_sweeps()
         self.fileName = None
         self.overallCaption = ""
-
-    def _output_html(self):
-        names = [name for name in self.widgets]
-        values = [widget.values() for widget in self.widgets.values()]
-        defaults = tuple([widget.default for widget in self.widgets.values()])
-
-        #Now reorder alphabetically by names so divnames match javascript
+        self.compress = False
+        self.layers = False
+        self.order = None
+        self.layout = "divs"
+        # image encoder of frames (see `encoders`), None for matplotlib's png
+        self.encoder = None
+        # crop frames of each panel to common bounding box of their content
+        self.trim = False
+        # size in pixels of square tiles of frames in "tiles" layout
+        self.tileSize = 64
+        # threads compressing frames while the main thread draws the next
+        # ones, when frames are rendered without worker processes (0 to
+        # compress in the main thread)
+        self.compressThreads = min(4, os.cpu_count() or 1)
+        # for compress="auto": size budget, whether frames can be
+        # downscaled, and scale, number of colours, average size of unique
+        # frames and number of unique frames planned from sampled frames
+        self.sizeBudget = None
+        self.downscale = False
+        self.scale = 1.
+        self.colors = None
+        self.frameBytes = None
+        self.uniqueFrames = None
+        # frames sampled for palette shared by all frames of a panel
+        self.paletteSamples = 8
+        self.buildReport = {}
+
+    def _make_panels(self, function):
+        if not isinstance(function, dict):
+            return [_Panel("", function, list(self.widgets))]
+        panels = []
+        for name, spec in function.items():
+            if not re.match(r"^[A-Za-z][\w-]*$", name):
+                raise ValueError("panel name %s should start with a letter and "
+                                 "contain only letters, digits, _ and -" % name)
+            if isinstance(spec, tuple):
+                panelFunction, dependencies = spec
+            else:
+                panelFunction = spec
+                parameters = inspect.signature(panelFunction).parameters.values()
+                if any(p.kind == p.VAR_KEYWORD for p in parameters):
+                    dependencies = list(self.widgets)
+                else:
+                    dependencies = [p.name for p in parameters
+                                    if p.name in self.widgets]
+            for dependency in dependencies:
+                if dependency not in self.widgets:
+                    raise ValueError("panel %s depends on %s which is not an "
+                                     "input of the figure" % (name, dependency))
+            panels.append(_Panel(name, panelFunction, dependencies))
+        return panels
+
+    def _find_sweeps(self):
+        """Sets input swept by batch functions (see `batch`) and generator
+        figure functions, which by default sweep the only RangeWidgetViridis
+        input of the panel"""
+        for panel in self.panels:
+            batchInput = getattr(panel.function, "batchInput", None)
+            if batchInput is not None:
+                if batchInput not in panel.dependencies:
+                    raise ValueError("batch input %s is not an input of %s"
+                                     % (batchInput, panel.function.__name__))
+                panel.sweep = batchInput
+                continue
+            if not inspect.isgeneratorfunction(panel.function):
+                continue
+            sweeps = [name for name in panel.dependencies
+                      if isinstance(self.widgets[name], RangeWidgetViridis)]
+            if len(sweeps) != 1:
+                raise ValueError("generator figure function %s should depend on "
+                                 "exactly one RangeWidgetViridis input, that it "
+                                 "sweeps" % panel.function.__name__)
+            panel.sweep = sweeps[0]
+
+    def _render_frames(self, function, kwargs, workers=1, cache=None,
+                       order=None, sweep=None):
+        """Yields (png, caption) of function for each of the kwargs, in the
+        same order, together with statistics of its rendering: whether it
+        was found in the cache, and seconds spent in each stage.
+
+        Frames found in the cache are not rendered again, the rest is
+        rendered in this process or, if workers > 1, in a process pool.
+
+        order lists positions in kwargs in the order in which frames are
+        rendered (see `_traversal`); frames rendered ahead of output are
+        kept until their turn.
+
+        If sweep names input of generator or batch function, frames that
+        differ only in its value are rendered by one call of the function.
+
+        In layers mode the static layer is rendered only with the first
+        frame, and frames are (overlay png, caption, static png or None).
+
+        Without worker processes, compression runs in `compressThreads`
+        threads, overlapping with drawing of the following frames.
+
+        If compress is `"shared"`, or True in `"tiles"` layout, frames are
+        quantized to a palette shared by all of them (see
+        `_shared_palette`).
+        """
+        # static layer is the same for all frames
+        static = [self.layers and i == 0 for i in range(len(kwargs))]
+        compress = self.compress
+        if compress is True and self.layout == "tiles":
+            # pngquant dithers each frame differently, so identical parts
+            # of frames wouldn't give identical tiles
+            compress = "shared"
+        if compress == "auto":
+            # frames are fitted to size budget as they are written
+            compress = False
+        elif compress == "shared":
+            compress = self._shared_palette(function, kwargs, cache=cache,
+                                            sweep=sweep)
+        if order is None:
+            order = range(len(kwargs))
+        # units of work, each rendered by a single task
+        if sweep is None:
+            units = [[i] for i in order]
+        else:
+            groups = OrderedDict()
+            for i in order:
+                others = tuple((k, v) for k, v in kwargs[i].items() if k != sweep)
+                groups.setdefault(others, []).append(i)
+            units = [sorted(unit, key=lambda i: kwargs[i][sweep])
+                     for unit in groups.values()]
+
+        if cache is not None:
+            functionHash = cache.functionHash(function)
+            keys = [cache.key(functionHash, k,
+                              self._cache_settings(compress, st))
+                    for k, st in zip(kwargs, static)]
+            render = [any(not cache.contains(keys[i]) for i in unit)
+                      for unit in units]
+        else:
+            render = [True] * len(units)
+        todo = [[kwargs[i] for i in unit]
+                for unit, r in zip(units, render) if r]
+        todoStatic = [[static[i] for i in unit]
+                      for unit, r in zip(units, render) if r]
+
+        if workers > 1 and len(todo) > 1:
+            # workers get a copy of the current matplotlib settings so that
+            # frames are identical to the ones rendered in this process
+            executor = ProcessPoolExecutor(max_workers=workers,
+                                           initializer=_init_worker,
+                                           initargs=(mpl.rcParams.copy(),))
+            chunksize = max(1, len(todo) // (4 * workers))
+            # map returns results in submission order, so the output
+            # is the same as for serial rendering
+            rendered = executor.map(_render_unit,
+                                    itertools.repeat(function),
+                                    itertools.repeat(sweep),
+                                    todo,
+                                    itertools.repeat(compress),
+                                    itertools.repeat(self.layers),
+                                    todoStatic,
+                                    itertools.repeat(self.encoder),
+                                    chunksize=chunksize)
+        elif compress is True and self.compressThreads > 0:
+            # pngquant runs in a pool of threads while this thread draws
+            # the next frames
+            executor = None
+            rendered = _pipeline((_render_unit(function, sweep, k,
+                                               layers=self.layers, static=st,
+                                               encoder=self.encoder)
+                                  for k, st in zip(todo, todoStatic)),
+                                 _quantize_frames, self.compressThreads)
+        else:
+            executor = None
+            rendered = (_render_unit(function, sweep, k,
+                                     compress=compress,
+                                     layers=self.layers, static=st,
+                                     encoder=self.encoder)
+                        for k, st in zip(todo, todoStatic))
+
+        buffered = {}
+        next_output = 0
+        try:
+            for unit, r in zip(units, render):
+                times = {}
+                if not r:
+                    start = time.perf_counter()
+                    frames = [cache.get(keys[i]) for i in unit]
+                    times["cache"] = time.perf_counter() - start
+                    if None in frames:
+                        # cache entry removed or unreadable in the meantime
+                        r = True
+                        frames, times = _render_unit(function, sweep,
+                                                     [kwargs[i] for i in unit],
+                                                     compress=compress,
+                                                     layers=self.layers,
+                                                     static=[static[i] for i in unit],
+                                                     encoder=self.encoder)
+                else:
+                    frames, times = next(rendered)
+                if r and cache is not None:
+                    start = time.perf_counter()
+                    for i, frame in zip(unit, frames):
+                        cache.put(keys[i], frame)
+                    times["cache"] = time.perf_counter() - start
+                # time of a sweep is shared by its frames
+                stats = {"cached": not r,
+                         "seconds": {stage: t / len(unit)
+                                     for stage, t in times.items()}}
+                buffered.update((i, (frame, stats))
+                                for i, frame in zip(unit, frames))
+                while next_output in buffered:
+                    yield buffered.pop(next_output)
+                    next_output += 1
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+            else:
+                rendered.close()
+
+    def _trim_frames(self, frames, panel):
+        """Crops frames of panel, as yielded by `_render_frames`, to the
+        union of bounding boxes of their content (see `_content_box`).
+        Overlays and static layer are cropped to the same box, so they
+        still line up. All frames of the panel are rendered (and kept in
+        memory) before the first one is yielded. Box and original size are
+        recorded in `buildReport["trim"]`."""
+        frames = list(frames)
+        start = time.perf_counter()
+        pngs = [png for frame, stats in frames for png in frame[::2]
+                if png is not None]
+        box = _content_box(pngs)
+        record = {"panel": panel.name, "box": box, "size": None}
+        if pngs:
+            record["size"] = list(Image.open(BytesIO(pngs[0])).size)
+        self.buildReport.setdefault("trim", []).append(record)
+        # time of finding the box is shared by frames
+        perFrame = (time.perf_counter() - start) / max(1, len(frames))
+        del pngs
+        for i in range(len(frames)):
+            (frame, stats), frames[i] = frames[i], None
+            start = time.perf_counter()
+            if box is not None:
+                frame = _map_pngs(lambda png: _crop_png(png, box, self.encoder),
+                                  [frame])[0]
+            stats = dict(stats, seconds=dict(stats["seconds"]))
+            stats["seconds"]["trim"] = perFrame + time.perf_counter() - start
+            yield frame, stats
+
+    def _cache_settings(self, compress, static):
+        """Settings of frame rendering, that are part of frame cache key"""
+        settings = {"compress": compress, "quality": (40, 100)}
+        if isinstance(compress, _Palette):
+            settings.update(compress="shared", palette=compress.digest)
+        if self.layers:
+            settings.update(layers=True, static=static)
+        if self.encoder is not None:
+            settings.update(self.encoder.settings())
+        return settings
+
+    def _shared_palette(self, function, kwargs, cache=None, sweep=None):
+        """Palette for all frames of function for kwargs, built from
+        `paletteSamples` frames evenly spread through them. These frames are
+        rendered without compression (and cached as such)."""
+        positions = np.unique(np.linspace(0, len(kwargs) - 1,
+                                          min(self.paletteSamples, len(kwargs))
+                                          ).round().astype(int))
+        if cache is not None:
+            functionHash = cache.functionHash(function)
+        images = []
+        for i in positions:
+            static = self.layers and i == 0
+            frame = None
+            if cache is not None:
+                key = cache.key(functionHash, kwargs[i],
+                                self._cache_settings(False, static))
+                frame = cache.get(key)
+            if frame is None:
+                frame = _render_unit(function, sweep, [kwargs[i]],
+                                     layers=self.layers, static=[static],
+                                     encoder=self.encoder)[0][0]
+                if cache is not None:
+                    cache.put(key, frame)
+            images += _frame_images([frame])
+        if not images:
+            # function doesn't return figures, nothing to compress
+            return False
+        return _Palette(images)
+
+    def _parameter_space(self, panel=None):
+        """Returns widget names, lists of their values and default values,
+        ordered alphabetically by widget name (order of frames). If panel is
+        given, only widgets that the panel depends on are included."""
+        widgets = self.widgets if panel is None else panel.widgets(self.widgets)
+        names = [name for name in widgets]
+        values = [widget.values() for widget in widgets.values()]
+        defaults = tuple([widget.default for widget in widgets.values()])
+        if not names:
+            return (), (), ()
+
+        #Now reorder alphabetically by names, this is the order of frames
         names,values,defaults = zip(*sorted(zip(names,values,defaults),
                                             key=lambda tup: tup[0].lower()))
+        return names, values, defaults
 
-        divnames = [''.join(['{0}{1}'.format(n, self._get_strrep(v))
-                             for n, v in zip(names, vals)])
-                    for vals in itertools.product(*values)]
-        display = [vals == defaults for vals in itertools.product(*values)]
+    @staticmethod
+    def _value_index(vals, value):
+        """Index of value in the list of widget values, or None if missing"""
+        for i, v in enumerate(vals):
+            if isinstance(value, str) or isinstance(v, str):
+                if v == value:
+                    return i
+            elif np.isclose(v, value, rtol=1e-9, atol=1e-12):
+                return i
+        return None
+
+    def _frame_index(self, panel, digits):
+        """Frame index from indices of widget values (mixed-radix number)"""
+        names, values, defaults = self._parameter_space(panel)
+        index = 0
+        for vals, digit in zip(values, digits):
+            index = index * len(vals) + digit
+        return index
+
+    def _frame_digits(self, panel, index):
+        """Indices of widget values for frame index"""
+        names, values, defaults = self._parameter_space(panel)
+        digits = []
+        for vals in reversed(values):
+            index, digit = divmod(index, len(vals))
+            digits.append(digit)
+        return digits[::-1]
+
+    def _sample(self, panel, sampling=None):
+        """Returns sorted indices of panel frames that will be rendered, or
+        None if all combinations of values are rendered.
 
-        tmplt = self.subdiv_template
+        Args:
+            sampling: None for all combinations, `"one-at-a-time"` for
+                combinations where at most one widget differs from its
+                default value, or list of combinations given as dictionaries
+                `{widgetName: value}` or as lists of values in the order
+                widgets were passed to InteractiveFigure.
+        """
+        if sampling is None:
+            return None
+        names, values, defaults = self._parameter_space(panel)
+        if isinstance(sampling, str):
+            if sampling != "one-at-a-time":
+                raise ValueError('sampling should be None, "one-at-a-time" '
+                                 'or list of combinations of values')
+            digits = []
+            for name, vals, default in zip(names, values, defaults):
+                digit = self._value_index(vals, default)
+                if digit is None:
+                    raise ValueError("default value of widget %s is not one "
+                                     "of its values" % name)
+                digits.append(digit)
+            indices = set([self._frame_index(panel, digits)])
+            for w, vals in enumerate(values):
+                for digit in range(len(vals)):
+                    combination = list(digits)
+                    combination[w] = digit
+                    indices.add(self._frame_index(panel, combination))
+            return sorted(indices)
+
+        indices = set()
+        for combination in sampling:
+            if not isinstance(combination, dict):
+                combination = dict(zip(self.widgets, combination))
+            if set(combination) != set(self.widgets):
+                raise ValueError("combination %s should give values for all "
+                                 "widgets %s" % (combination, list(self.widgets)))
+            digits = []
+            for name, vals in zip(names, values):
+                digit = self._value_index(vals, combination[name])
+                if digit is None:
+                    raise ValueError("%s is not one of the values of widget %s"
+                                     % (combination[name], name))
+                digits.append(digit)
+            indices.add(self._frame_index(panel, digits))
+        return sorted(indices)
+
+    def _nearest_frame(self, panel, digits, indices):
+        """Rendered frame closest to combination of value indices digits,
+        same as nearestFrame() in javascript"""
+        names, values, defaults = self._parameter_space(panel)
+        ordered = [isinstance(self.widgets[name], RangeWidget) for name in names]
+        best, bestDistance = None, np.inf
+        for index in indices:
+            distance = 0
+            for o, vals, d, r in zip(ordered, values, digits,
+                                     self._frame_digits(panel, index)):
+                if o:
+                    distance += abs(d - r) / max(1, len(vals) - 1)
+                else:
+                    distance += (d != r)
+            if distance < bestDistance:
+                best, bestDistance = index, distance
+        return best
+
+    def _frame_order(self, panel, indices=None):
+        """Description of panel frame ordering used by javascript to find
+        frame index from the indices of selected widget values. indices lists
+        rendered frames if not all combinations are rendered."""
+        names, values, defaults = self._parameter_space(panel)
+        digits = [self._value_index(vals, default)
+                  for vals, default in zip(values, defaults)]
+        if None in digits:
+            current = -1  # default combination is not rendered
+        else:
+            current = self._frame_index(panel, digits)
+            if indices is not None and current not in indices:
+                current = self._nearest_frame(panel, digits, indices)
+        return {"prefix": panel.prefix,
+                "widgets": [[name, len(vals)]
+                            for name, vals in zip(names, values)],
+                "current": current,
+                "rendered": indices}
+
+    def _traversal(self, panel, indices):
+        """Positions in indices (frame indices of the panel) in the order in
+        which frames are rendered, or None for the order of frames.
+
+        Order `"gray"` is reflected mixed-radix Gray code, where consecutive
+        frames differ in a single step of one widget. List of widget names
+        renders widgets listed first in the outermost loops, so they change
+        least often; remaining widgets follow in the usual order.
+        """
+        order = self.order
+        if order is None or order == "lexicographic":
+            return None
+        names, values, defaults = self._parameter_space(panel)
+        digits = [self._frame_digits(panel, index) for index in indices]
+        if order == "gray":
+            def key(d):
+                rank = 0
+                for vals, digit in zip(values, d):
+                    if rank % 2:
+                        digit = len(vals) - 1 - digit
+                    rank = rank * len(vals) + digit
+                return rank
+        elif isinstance(order, str):
+            raise ValueError('order should be "lexicographic", "gray" or '
+                             'list of widget names')
+        else:
+            for name in order:
+                if name not in self.widgets:
+                    raise ValueError("order lists %s which is not an input of "
+                                     "the figure" % name)
+            outer = [names.index(name) for name in order if name in names]
+            loops = outer + [w for w in range(len(names)) if w not in outer]
+            def key(d):
+                return [d[w] for w in loops]
+        return sorted(range(len(indices)), key=lambda i: key(digits[i]))
+
+    def _iter_output_html(self, workers=1, cache=None, assetDir=None,
+                          layout="divs", sampling=None, progress=None,
+                          reserved=0):
+        """Yields HTML of the frames one by one, as they are rendered.
+
+        If assetDir is given, frames are saved as png files in that directory,
+        and referenced by path relative to the directory of the HTML file.
+
+        Identical frames are stored only once: files are named by hash of
+        their content, and inline images are referenced from other frames.
+
+        Layout `"divs"` puts each frame in its own div, while `"viewer"`
+        stores frames in javascript arrays shown in a single img element.
+        Layout `"tiles"` splits frames into tiles (see `_tile_frame`), that
+        are drawn on a canvas.
+
+        sampling selects which frames are rendered (see `_sample`).
+
+        progress is called as progress(done, total, record) after each frame,
+        where record is per-frame entry of the build report.
+
+        If compress is `"auto"`, each new frame is compressed to fit in its
+        share of bytes left from `sizeBudget`, after reserved bytes of the
+        document around the frames. Chosen number of colours is recorded
+        in the report.
+        """
+        stored = {}  # hash of png -> asset file name, img id or image number
+        tiles = {}  # hash of tile pixels -> tile number, for "tiles" layout
+        report = self.buildReport
+        report["frames"] = 0
+        report["combinations"] = int(np.prod(
+            [len(vals) for vals in self._parameter_space()[1]]))
+        report["uniqueFrames"] = 0
+        report["pngBytes"] = 0
+        report["seconds"] = {}
+        report["perFrame"] = []
+        # sampled frame indices of each panel
+        panelIndices = []
+        for panel in self.panels:
+            indices = self._sample(panel, sampling)
+            if indices is None:
+                indices = range(int(np.prod([len(vals) for vals in
+                                             self._parameter_space(panel)[1]])))
+            panelIndices.append(indices)
+        total = sum(len(indices) for indices in panelIndices)
+        budget = None
+        mimeType = self._mime_type()
+        if self.compress == "auto":
+            budget = _Budget(self.sizeBudget - reserved, total, self.frameBytes,
+                             self.colors, self.scale, inline=assetDir is None,
+                             downscale=self.downscale, unique=self.uniqueFrames)
+            fitted = {}  # hash of png -> chosen number of colours
+            fittedPngs = {}  # hash of png -> png fitted in the budget
+            report["scale"] = self.scale
+        buildStart = time.perf_counter()
+        for panelNumber, panel in enumerate(self.panels):
+            names, values, defaults = self._parameter_space(panel)
+            indices = panelIndices[panelNumber]
+            current = self._frame_order(panel, self._sample(panel, sampling))["current"]
+            combinations = [tuple(vals[d] for vals, d in
+                                  zip(values, self._frame_digits(panel, index)))
+                            for index in indices]
+            kwargs = [dict(zip(names, vals)) for vals in combinations]
+
+            tmplt = self.subdiv_template
+            if panel.name:
+                panelHeader, panelFooter = self.panel_template.format(
+                    name=panel.name).split("{frames}")
+                yield panelHeader
+            if layout in ("viewer", "tiles"):
+                viewerHeader, viewerFooter = (self.tiles_template if layout == "tiles"
+                                              else self.viewer_template).format(
+                    prefix=panel.prefix).split("{frames}")
+                yield viewerHeader
+            elif self.layers:
+                layersHeader, layersFooter = self.layers_template.split("{frames}")
+                yield layersHeader
+
+            frames = self._render_frames(panel.function, kwargs,
+                                         workers=workers, cache=cache,
+                                         order=self._traversal(panel, indices),
+                                         sweep=panel.sweep)
+            if self.trim:
+                frames = self._trim_frames(frames, panel)
+            report["frames"] += len(combinations)
+            # frames are in itertools.product order, so frame index is the
+            # mixed-radix number that javascript computes from value indices
+            frameIterator = iter(frames)
+            for index in indices:
+                start = time.perf_counter()
+                frame, stats = next(frameIterator)
+                waited = time.perf_counter() - start
+                png_rep, caption = frame[:2]
+                parts = []
+                start = time.perf_counter()
+                fitting = 0.
+                assetBytes = 0
+                counted = 0
+                if self.layers and frame[2] is not None:
+                    static_rep = frame[2]
+                    if budget is not None:
+                        static_rep, report["staticColors"] = budget.fit(
+                            static_rep, following=budget.uniqueLeft())
+                        fitting += time.perf_counter() - start
+                    parts.append(self._static_html(static_rep, panelNumber,
+                                                   assetDir, layout))
+                    report["pngBytes"] += len(static_rep)
+                    if assetDir is not None:
+                        assetBytes += len(static_rep)
+                    if budget is not None:
+                        # overlay is fitted in what is left after static layer
+                        counted = len(parts[-1].encode("utf-8")) + assetBytes
+                        budget.spend(counted)
+                new = False
+                colors = None
+                if png_rep is None:
+                    content = _png_html(png_rep)
+                    image = -1
+                else:
+                    digest = hashlib.md5(png_rep).hexdigest()[:16]
+                    new = digest not in stored
+                    if new and budget is not None:
+                        fitStart = time.perf_counter()
+                        # identical frames are recognized before fitting
+                        png_rep, fitted[digest] = budget.fit(
+                            png_rep, len(tmplt) + len(caption),
+                            following=max(0, budget.uniqueLeft() - 1))
+                        fittedPngs[digest] = png_rep
+                        fitting += time.perf_counter() - fitStart
+                    if new and assetDir is not None and layout != "tiles":
+                        assetBytes += len(png_rep)
+                    if budget is not None:
+                        colors = fitted[digest]
+                    if layout == "tiles":
+                        if new:
+                            stored[digest], newTiles = self._tile_frame(
+                                png_rep, tiles, assetDir)
+                            for src, tileBytes in newTiles:
+                                parts.append("addTile(%s);\n" % _js_string(src))
+                                if assetDir is not None:
+                                    assetBytes += tileBytes
+                            tileBytes = sum(b for src, b in newTiles)
+                        image = stored[digest]
+                    elif layout == "viewer":
+                        if new:
+                            stored[digest] = len(stored)
+                            if assetDir is not None:
+                                src = self._save_asset(assetDir, digest, png_rep)
+                            else:
+                                src = _data_uri(png_rep, mimeType)
+                            parts.append("addImage(%s);\n" % _js_string(src))
+                        image = stored[digest]
+                    elif assetDir is not None:
+                        if new:
+                            stored[digest] = self._save_asset(assetDir, digest, png_rep)
+                        content = _png_file_html(stored[digest])
+                    elif new:
+                        stored[digest] = "i" + _base36(len(stored))
+                        content = _png_html(png_rep, imgId=stored[digest],
+                                            mimeType=mimeType)
+                    elif index == current:
+                        # default frame is shown also without javascript
+                        if budget is not None:
+                            png_rep = fittedPngs[digest]
+                        content = _png_html(png_rep, mimeType=mimeType)
+                    else:
+                        content = _png_reference_html(stored[digest])
+                encoded = time.perf_counter()
+                if layout in ("viewer", "tiles"):
+                    parts.append("addFrame(%d, %d, %s, %s);\n" % (
+                        panelNumber, index, image, _js_string(escape(caption))))
+                else:
+                    parts.append(tmplt.format(name=_frame_id(index, panel.prefix),
+                                              display="block" if index == current else "none",
+                                              content=content,
+                                              caption=escape(caption)))
+                seconds = dict(stats["seconds"])
+                seconds["wait"] = waited
+                seconds["encode"] = encoded - start - fitting
+                if budget is not None:
+                    seconds["quantize"] = seconds.get("quantize", 0.) + fitting
+                seconds["html"] = time.perf_counter() - encoded
+                pngBytes = len(png_rep) if png_rep is not None else 0
+                if layout == "tiles" and new:
+                    pngBytes = tileBytes
+                record = {"panel": panel.name, "index": int(index),
+                          "cached": stats["cached"], "unique": new,
+                          "bytes": pngBytes, "seconds": seconds}
+                if budget is not None:
+                    record["colors"] = colors
+                report["perFrame"].append(record)
+                report["uniqueFrames"] = len(stored)
+                if layout == "tiles":
+                    report["uniqueTiles"] = len(tiles)
+                if new:
+                    report["pngBytes"] += pngBytes
+                for stage, t in seconds.items():
+                    report["seconds"][stage] = report["seconds"].get(stage, 0.) + t
+                if progress is not None:
+                    progress(len(report["perFrame"]), total, record)
+                html = "".join(parts)
+                if budget is not None:
+                    budget.spend(len(html.encode("utf-8")) + assetBytes - counted,
+                                 frames=1, unique=int(new))
+                yield html
+            if layout in ("viewer", "tiles"):
+                yield viewerFooter
+            elif self.layers:
+                yield layersFooter
+            if panel.name:
+                yield panelFooter
+        if cache is not None:
+            cache.evict()
+        report["seconds"]["total"] = time.perf_counter() - buildStart
+
+    def _tile_frame(self, png_rep, tiles, assetDir=None):
+        """Splits png into square tiles of `tileSize` pixels (smaller at
+        the right and bottom edge). Tiles that are not yet in tiles (hash
+        of tile pixels -> tile number) are encoded and added to it, fully
+        transparent tiles are not stored. Returns javascript array
+        [width, height, tile size, tile numbers by rows, -1 for transparent
+        tiles] and list of (source, bytes) of new tiles."""
+        image = Image.open(BytesIO(png_rep))
+        rgba = np.asarray(image.convert("RGBA"))
+        height, width = rgba.shape[:2]
+        size = self.tileSize
+        numbers = []
+        newTiles = []
+        for top in range(0, height, size):
+            for left in range(0, width, size):
+                tile = rgba[top:top + size, left:left + size]
+                if not tile[:, :, 3].any():
+                    numbers.append(-1)
+                    continue
+                digest = hashlib.md5(repr(tile.shape).encode("utf-8")
+                                     + tile.tobytes()).hexdigest()[:16]
+                if digest not in tiles:
+                    tiles[digest] = len(tiles)
+                    tile_rep = _crop_image(image, (left, top,
+                                                   left + tile.shape[1],
+                                                   top + tile.shape[0]),
+                                           self.encoder)
+                    if assetDir is not None:
+                        src = self._save_asset(assetDir, digest, tile_rep)
+                    else:
+                        src = _data_uri(tile_rep, self._mime_type())
+                    newTiles.append((src, len(tile_rep)))
+                numbers.append(tiles[digest])
+        return json.dumps([width, height, size, numbers]), newTiles
+
+    def _static_html(self, png_rep, panelNumber, assetDir=None, layout="divs"):
+        """HTML (or javascript for viewer layout) of the static layer, that
+        is shown under frames of the panel"""
+        if assetDir is not None:
+            digest = hashlib.md5(png_rep).hexdigest()[:16]
+            src = self._save_asset(assetDir, digest, png_rep)
+        else:
+            src = _data_uri(png_rep, self._mime_type())
+        if layout in ("viewer", "tiles"):
+            return "setStatic(%d, %s);\n" % (panelNumber, _js_string(src))
+        return '<img alt="figure" class="ifigurestatic" src="{0}"/>'.format(escape(src))
+
+    def _save_asset(self, assetDir, digest, png_rep):
+        """Saves png in assetDir and returns its path relative to HTML file"""
+        name = digest + (self.encoder.extension if self.encoder is not None
+                         else ".png")
+        with open(os.path.join(assetDir, name), "wb") as f:
+            f.write(png_rep)
+        return os.path.basename(assetDir) + "/" + name
+
+    def _mime_type(self):
+        """MIME type of frame images"""
+        return self.encoder.mimeType if self.encoder is not None else "image/png"
+
+    def _output_html(self, workers=1, cache=None, sampling=None):
+        return "".join(self._iter_output_html(workers=workers, cache=cache,
+                                              sampling=sampling))
+
+    def estimate(self, compress:bool=False, workers:int=1,
+                 assets:str="inline", sampling=None, layers:bool=False,
+                 samples:int=5, sizeBudget:int=None, encoder=None,
+                 trim:bool=False, layout:str="divs") -> dict:
+        """Estimates time and size of `saveStandaloneHTML` with the same
+        arguments, without saving the figure. Few combinations of input
+        values, evenly spread through all frames, are rendered to measure
+        time per frame and frame size.
+
+        Identical frames are stored once, so the number of unique frames
+        is estimated from the fraction of sampled frames that are unique.
+        Time is an upper bound, since identical frames are still rendered.
+        Time for several workers assumes that they run in parallel on
+        separate processor cores. For
+        `compress="auto"` size with the fewest colours used without
+        downscaling is estimated, i.e. the smallest size that fits the
+        size budget.
 
-        r = []
-        i = 0
-        for vals in itertools.product(*values):
-            figure = self.function(**dict(zip(names, vals)))
-            r.append(tmplt.format(name=divnames[i],
-                                    display="block" if display[i] else "none",
-                                    content=_get_html(figure[0], compress=self.compress),
-                                    caption=escape(figure[1])))
-            i += 1
-        return "".join(r)
+        Args:
+            compress (bool | str, optional): see `saveStandaloneHTML`.
+            workers (int, optional): see `saveStandaloneHTML`.
+            assets (str, optional): see `saveStandaloneHTML`.
+            sampling (str | List, optional): see `saveStandaloneHTML`.
+            layers (bool, optional): see `saveStandaloneHTML`.
+            samples (int, optional): number of rendered frames per panel.
+                Defaults to 5.
+            sizeBudget (int, optional): if estimated size of saved files in
+                bytes is larger, warning is issued. Defaults to None.
+            encoder (ImageEncoder, optional): see `saveStandaloneHTML`.
+            trim (bool, optional): see `saveStandaloneHTML`. Sampled
+                frames of each panel are cropped to bounding box of their
+                content.
+            layout (str, optional): see `saveStandaloneHTML`.
 
+        Returns:
+            dict: `frames` (number of rendered frames), `combinations`
+                (number of combinations of input values), `secondsPerFrame`,
+                `bytesPerFrame`, `seconds` (estimated build time) and `bytes`
+                (estimated total size of HTML and frame files).
+        """
+        with self._settings(encoder=encoder, trim=trim):
+            sampled = self._sample_frames(sampling=sampling, layers=layers,
+                                          samples=samples)
+        frames = sum(count for count, rendered, perFrame in sampled)
+        seconds = 0.
+        compressed = []
+        for count, rendered, perFrame in sampled:
+            start = time.perf_counter()
+            images = _frame_images(rendered) if compress == "shared" else []
+            if compress is True:
+                rendered = _map_pngs(pngquant, rendered)
+            elif images:
+                # samples are also used for the palette, as when saving
+                rendered = _map_pngs(_Palette(images).quantize, rendered)
+            elif compress == "auto":
+                rendered = _map_pngs(lambda png: pngquant(
+                    png, quality=(0, 100), colors=MIN_COLORS), rendered)
+            perFrame += (time.perf_counter() - start) / len(rendered)
+            seconds += perFrame * count
+            compressed.append((count, rendered))
+        size = self._predicted_size(compressed, assets,
+                                    self._overhead_bytes(layout=layout,
+                                                         sampling=sampling,
+                                                         layers=layers),
+                                    layout=layout)
+        estimate = {"frames": frames,
+                    "combinations": int(np.prod(
+                        [len(vals) for vals in self._parameter_space()[1]])),
+                    "secondsPerFrame": seconds / max(1, frames),
+                    "bytesPerFrame": float(size / max(1, frames)),
+                    "seconds": seconds / max(1, workers),
+                    "bytes": int(size)}
+        if sizeBudget is not None and estimate["bytes"] > sizeBudget:
+            warnings.warn("interactive figure of %d frames will take about "
+                          "%.2f MB, more than size budget of %.2f MB"
+                          % (frames, size / 1e6, sizeBudget / 1e6))
+        return estimate
+
+    def _sample_frames(self, sampling=None, layers=False, samples=5):
+        """Renders, without compression, few frames of each panel, evenly
+        spread through its frames, and crops them to their common bounding
+        box if `trim` is set. Returns list of (number of frames, rendered
+        frames, seconds per frame) for each panel."""
+        sampled = []
+        for panel in self.panels:
+            names, values, defaults = self._parameter_space(panel)
+            indices = self._sample(panel, sampling)
+            if indices is None:
+                indices = range(int(np.prod([len(vals) for vals in values])))
+            picked = np.unique(np.linspace(0, len(indices) - 1,
+                                           min(samples, len(indices))).round())
+            start = time.perf_counter()
+            rendered = []
+            for i, position in enumerate(picked.astype(int)):
+                digits = self._frame_digits(panel, indices[position])
+                kwargs = dict(zip(names, [vals[d] for vals, d
+                                          in zip(values, digits)]))
+                rendered += _render_unit(panel.function, panel.sweep, [kwargs],
+                                         layers=layers,
+                                         static=[layers and i == 0],
+                                         encoder=self.encoder)[0]
+            if self.trim:
+                box = _content_box(png for frame in rendered
+                                   for png in frame[::2] if png is not None)
+                if box is not None:
+                    rendered = _map_pngs(
+                        lambda png: _crop_png(png, box, self.encoder), rendered)
+            sampled.append((len(indices), rendered,
+                            (time.perf_counter() - start) / len(rendered)))
+        return sampled
+
+    def _overhead_bytes(self, layout="divs", sampling=None, layers=False):
+        """Bytes of standalone HTML document around the frames: header and
+        footer, and wrappers of frames of each panel"""
+        header, footer = self._document_html(layout=layout, sampling=sampling)
+        return (len((header + footer).encode("utf-8"))
+                + self._wrapper_bytes(layout=layout, layers=layers))
+
+    def _wrapper_bytes(self, layout="divs", layers=False):
+        """Bytes of HTML around frames of each panel"""
+        size = 0
+        for panel in self.panels:
+            if panel.name:
+                size += len(self.panel_template.format(name=panel.name)) \
+                    - len("{frames}")
+            if layout in ("viewer", "tiles"):
+                size += len((self.tiles_template if layout == "tiles"
+                             else self.viewer_template).format(
+                                 prefix=panel.prefix)) - len("{frames}")
+            elif layers:
+                size += len(self.layers_template) - len("{frames}")
+        return size
+
+    def _predicted_size(self, sampled, assets, overhead, layout="divs"):
+        """Size of saved files, if frames of each panel are as large as
+        sampled frames on average, and the number of unique frames is as
+        estimated from the sampled ones (identical frames are stored once).
+        sampled lists (number of frames, sampled frames) for each panel,
+        overhead are bytes of the document around frames (see
+        `_overhead_bytes`)."""
+        size = overhead
+        base64Ratio = 4 / 3 if assets == "inline" else 1
+        for count, rendered in sampled:
+            pngs = [frame[0] for frame in rendered if frame[0] is not None]
+            digests = [hashlib.md5(png).digest() for png in pngs]
+            unique = dict(zip(digests, [len(png) for png in pngs]))
+            uniqueFrames = _unique_frames(count, digests)
+            captionBytes = np.mean([len(frame[1]) for frame in rendered])
+            if layout in ("viewer", "tiles"):
+                # frames refer to images added by number
+                size += count * (len("addFrame(0, 0, 0, '');\n") + captionBytes)
+                imageBytes = len("addImage('');\n")
+            else:
+                size += count * (len(self.subdiv_template) + captionBytes)
+                size += (count - uniqueFrames) * len(_png_reference_html("i0"))
+                imageBytes = 0
+            if unique:
+                size += uniqueFrames * (np.mean(list(unique.values()))
+                                        * base64Ratio + imageBytes)
+            if len(rendered[0]) > 2 and rendered[0][2] is not None:
+                size += len(rendered[0][2]) * base64Ratio  # static layer
+        return size
+
+    def _plan_budget(self, sizeBudget, assets="inline", layout="divs",
+                     sampling=None, layers=False, downscale=False):
+        """Plans `compress="auto"` from few sampled frames: the most colours
+        (at least `MIN_COLORS`) at which saved files fit in sizeBudget or,
+        if downscale is True and even `MIN_COLORS` don't fit, the largest
+        scale of frames (within 5%) at which they fit with `MIN_COLORS`.
+        Identical frames are counted once. Returns (scale, number of
+        colours or None if frames don't fit, average size of unique sampled
+        frame in bytes, estimated number of unique frames, predicted size in
+        bytes)."""
+        sampled = self._sample_frames(sampling=sampling, layers=layers)
+        overhead = self._overhead_bytes(layout=layout, sampling=sampling,
+                                        layers=layers)
+        uniqueFrames = sum(_unique_frames(count, [hashlib.md5(frame[0]).digest()
+                                                  for frame in rendered
+                                                  if frame[0] is not None])
+                           for count, rendered, perFrame in sampled)
+
+        def quantized(scale, colors):
+            return [(count, _map_pngs(lambda png: pngquant(
+                        scale_png(png, scale), quality=(0, 100), colors=colors),
+                        rendered))
+                    for count, rendered, perFrame in sampled]
+
+        def frameBytes(frames):
+            unique = {frame[0] for count, rendered in frames
+                      for frame in rendered if frame[0] is not None}
+            return np.mean([len(png) for png in unique] or [1])
+
+        def predicted(frames):
+            return self._predicted_size(frames, assets, overhead, layout=layout)
+
+        # size without images; their digests keep identical frames identical
+        fixed = predicted([(count, _map_pngs(lambda png: hashlib.md5(png).digest(),
+                                             rendered))
+                           for count, rendered, perFrame in sampled])
+        colors = [c for c in COLORS if c >= MIN_COLORS]
+        scale = 1.
+        while True:
+            # binary search for the most colours that fit, size decreases
+            # with the number of colours
+            low, high = 0, len(colors) - 1
+            sizes = {}
+            while low <= high:
+                middle = (low + high) // 2
+                frames = quantized(scale, colors[middle])
+                sizes[colors[middle]] = (frameBytes(frames), uniqueFrames,
+                                         predicted(frames))
+                if sizes[colors[middle]][2] <= sizeBudget:
+                    high = middle - 1
+                else:
+                    low = middle + 1
+            if low < len(colors):
+                return (scale, colors[low]) + sizes[colors[low]]
+            smallest = sizes[colors[-1]][2]
+            if not downscale or sizeBudget <= fixed or scale < 0.05:
+                return (scale, None) + sizes[colors[-1]]
+            # bytes of frames grow with number of pixels at most
+            scale *= 0.95 * ((sizeBudget - fixed) / (smallest - fixed))**0.5
 
     def _widget_html(self):
         return "\n<br>\n".join([widget.html()
                                 for name, widget in sorted(self.widgets.items())])
 
-    def html(self, beautify=True):
-        return self.standalone_template.format(css=self.css_style + (self.css_beatify if beautify else ""),
-                                                   outputs=self._output_html(),
-                                                   widgets=self._widget_html())
-
-    def saveStandaloneHTML(self, fileName:str, compress:bool=False):
+    def _document_html(self, beautify=True, layout="divs", sampling=None):
+        """Header and footer of standalone HTML document, around frames"""
+        css = self.css_style + (self.css_beatify if beautify else "")
+        widgets = self._widget_html()
+        framePanels = [self._frame_order(panel, self._sample(panel, sampling))
+                       for panel in self.panels]
+        parts = dict(css=css, widgets=widgets,
+                     frame_panels=json.dumps(framePanels),
+                     display_script={"viewer": self.viewer_script,
+                                     "tiles": self.tiles_script}.get(
+                                         layout, self.frames_script))
+        header, footer = self.standalone_template.split("{outputs}")
+        return header.format(**parts), footer.format(**parts)
+
+    @contextmanager
+    def _settings(self, **settings):
+        """Sets given attributes (settings of the build) and restores their
+        previous values on exit"""
+        previous = {name: getattr(self, name) for name in settings}
+        for name, value in settings.items():
+            setattr(self, name, value)
+        try:
+            yield
+        finally:
+            for name, value in previous.items():
+                setattr(self, name, value)
+
+    def _iter_html(self, beautify=True, workers=1, cache=None, assetDir=None,
+                   layout="divs", sampling=None, progress=None):
+        """Yields standalone HTML document in parts: header, frames one by
+        one as they are rendered, and footer"""
+        header, footer = self._document_html(beautify=beautify, layout=layout,
+                                             sampling=sampling)
+        reserved = (len((header + footer).encode("utf-8"))
+                    + self._wrapper_bytes(layout=layout, layers=self.layers))
+        yield header
+        yield from self._iter_output_html(workers=workers, cache=cache,
+                                          assetDir=assetDir, layout=layout,
+                                          sampling=sampling, progress=progress,
+                                          reserved=reserved)
+        yield footer
+
+    def html(self, beautify=True, workers=1, cache=None, layout="divs",
+             sampling=None, layers=False, order=None):
+        self.layers = layers
+        self.order = order
+        self.layout = layout
+        return "".join(self._iter_html(beautify=beautify, workers=workers,
+                                       cache=cache, layout=layout,
+                                       sampling=sampling))
+
+    def saveStandaloneHTML(self, fileName:str, compress:bool=False, workers:int=1,
+                           cache=None, assets:str="inline", layout:str="divs",
+                           sampling=None, layers:bool=False, order=None,
+                           sizeBudget:int=None, progress=None,
+                           downscale:bool=False, encoder=None,
+                           trim:bool=False):
         """Saves interactive figure as stand alone HTML file
 
+        After saving, `buildReport` attribute holds statistics of the build,
+        that can be saved with `json.dump`: numbers of frames, combinations
+        and unique frames, bytes produced, cache hits and misses, and
+        seconds spent in each stage of the build (figure function,
+        rasterization, quantization, cache, trimming, encoding, HTML
+        formatting and waiting for worker processes) in total and for each frame
+        (`perFrame`).
+
         Args:
             fileName (str): test
-            compress (bool, optional): test. Defaults to False.
+            compress (bool | str, optional): compress frames with
+                [pngquant](https://pngquant.org/). With a single worker,
+                frames are compressed in `compressThreads` threads
+                (attribute, by default up to 4) while the following frames
+                are drawn. `"shared"` quantizes all frames of the figure to
+                the same palette of up to 256 colours, built from
+                `paletteSamples` frames (attribute, by default 8). This is
+                faster than pngquant, keeps colours from changing between
+                frames, and usually gives smaller files, but colours that
+                don't appear in sampled frames are approximated by the
+                closest palette colour. `"auto"` quantizes each frame with
+                pngquant to the most colours at which saved files fit in
+                sizeBudget; number of colours of each frame is recorded in
+                `buildReport["perFrame"]`.
+                Defaults to False.
+            workers (int, optional): number of processes used to render
+                and compress frames. Output is identical to the serial
+                rendering. For values larger than 1 figure function has to
+                be defined at the top level of a module (so that it can
+                be pickled), and on platforms that spawn processes
+                (Windows, macOS) script has to be protected with
+                `if __name__ == "__main__":`. Defaults to 1.
+            cache (bool | FrameCache, optional): if `True` (or
+                [FrameCache](#ifigures.FrameCache) object), rendered frames
+                are stored on disk, and on the next call only frames for new
+                or changed combinations of input values are rendered.
+                Defaults to None.
+            assets (str, optional): `"inline"` embeds all frames in the HTML
+                file, as needed for EPUB. `"external"` saves frames as image
+                files in directory next to the HTML file (`example_files`
+                for `example.html`), which browser loads only when
+                the frame is selected. Defaults to "inline".
+            layout (str, optional): `"divs"` puts every frame in its own
+                HTML element. `"viewer"` keeps frames in a javascript array
+                and shows them in a single image, decoding neighbouring
+                frames in advance. This uses much less memory and loads
+                faster in e-readers for figures with many frames.
+                `"tiles"` splits frames into square tiles of `tileSize`
+                pixels (attribute, by default 64), stores every distinct
+                tile once, and draws the frame from its tiles on a canvas.
+                When input values change only part of the figure (e.g. a
+                moving marker), this is many times smaller. Number of
+                distinct tiles is recorded in `buildReport["uniqueTiles"]`.
+                With `compress=True` (or `"shared"`) frames are quantized to
+                one palette before they are split, which keeps identical
+                parts of frames identical; `"auto"` is not supported.
+                Defaults to "divs".
+            sampling (str | List, optional): which combinations of input
+                values are rendered. `None` renders all combinations.
+                `"one-at-a-time"` varies one input at a time while others
+                are at their default values. Alternatively, explicit list of
+                combinations can be given, as dictionaries
+                `{inputName: value}` or as lists of values in the order of
+                inputs (as in `saveStaticFigure`). For combinations that are
+                not rendered the closest rendered one is shown. Defaults to
+                None.
+            layers (bool, optional): if `True`, only artists marked as
+                dynamic with `artist.set_animated(True)` are drawn in each
+                frame, on transparent background. The rest of the figure
+                (axes, labels, reference curves) is rendered once, from the
+                first frame, and shown under the frames. Static artists
+                should therefore be the same for all input values.
+                Defaults to False.
+            order (str | List[str], optional): order in which frames are
+                rendered; saved file is the same for all orders.
+                `"lexicographic"` (or `None`) follows alphabetically sorted
+                input names. `"gray"` changes a single input by one step
+                between consecutive frames. List of input names renders
+                the listed inputs in the outermost loops, e.g. expensive
+                parameter first so that results computed (and memoized) for
+                its value are reused by the following frames. Frames
+                rendered ahead of the output order are kept in memory until
+                written. Defaults to None.
+            sizeBudget (int, optional): maximal size of saved files in bytes.
+                If given, size is first estimated (see `estimate`) and
+                figure is not saved if it would be larger. With
+                `compress="auto"` frames are compressed as much as needed
+                to fit. Defaults to None.
+            progress (bool | Callable, optional): if `True`, number of
+                rendered frames is printed while saving. Function is called
+                as `progress(done, total, record)` after each frame, with
+                the frame entry of `buildReport["perFrame"]`.
+                Defaults to None.
+            downscale (bool, optional): with `compress="auto"`, if frames
+                can't fit in sizeBudget even with 16 colours, all of them
+                are reduced in size by the same factor (recorded as
+                `buildReport["scale"]`), instead of reducing colours
+                further; no frame is then quantized to fewer than 16
+                colours. Defaults to False.
+            encoder (ImageEncoder, optional): encodes frames from the RGBA
+                buffer of the figure, e.g. `PNGEncoder(compressLevel=1)`
+                for fast png, or `WebPEncoder()` (lossless) and
+                `WebPEncoder(lossless=False, quality=80)` for frames that
+                are usually several times smaller than png for colour maps
+                and photographs (see `ifigures.encoders`). Frames are
+                embedded (or saved) with the matching MIME type. Only png
+                frames can be compressed. `None` saves frames with
+                matplotlib's png writer. Defaults to None.
+            trim (bool, optional): if `True`, frames of each panel are
+                cropped to the union of bounding boxes of their content,
+                removing margins of background colour (colour of all four
+                corners, or transparent) shared by all frames. Static layer
+                is cropped to the same box, so layers still line up. Crop
+                box and original size of frames of each panel are recorded
+                in `buildReport["trim"]`. Frames of a panel are kept in
+                memory until all of them are rendered. Defaults to False.
+
+        Raises:
+            ValueError: if estimated size is larger than sizeBudget,
+                compress is `"auto"` and sizeBudget is not given, or
+                frames are compressed, but encoder doesn't give png.
         """
+        if assets not in ("inline", "external"):
+            raise ValueError('assets should be "inline" or "external"')
+        if compress not in (False, True, "shared", "auto"):
+            raise ValueError('compress should be True, False, "shared" or "auto"')
+        if compress == "auto" and sizeBudget is None:
+            raise ValueError('compress="auto" needs sizeBudget')
+        if compress == "auto" and layout == "tiles":
+            raise ValueError('compress="auto" is not supported with '
+                             'layout="tiles"')
+        if layout not in ("divs", "viewer", "tiles"):
+            raise ValueError('layout should be "divs", "viewer" or "tiles"')
+        if compress and encoder is not None and encoder.mimeType != "image/png":
+            raise ValueError("only png frames can be compressed, not %s"
+                             % encoder.mimeType)
+        if compress == "auto":
+            with self._settings(encoder=encoder, trim=trim, order=order):
+                scale, colors, frameBytes, uniqueFrames, predicted = self._plan_budget(
+                    sizeBudget, assets=assets, layout=layout,
+                    sampling=sampling, layers=layers, downscale=downscale)
+            if colors is None:
+                raise ValueError("interactive figure would take about %.2f MB "
+                                 "even with %d colours, more than size budget "
+                                 "of %.2f MB%s" % (predicted / 1e6, MIN_COLORS,
+                                                   sizeBudget / 1e6,
+                                                   "" if downscale else
+                                                   " (downscale=True reduces "
+                                                   "size of frames)"))
+        elif sizeBudget is not None:
+            estimate = self.estimate(compress=compress, assets=assets,
+                                     sampling=sampling, layers=layers,
+                                     encoder=encoder, trim=trim,
+                                     layout=layout)
+            if estimate["bytes"] > sizeBudget:
+                raise ValueError("interactive figure of %d frames would take "
+                                 "about %.2f MB, more than size budget of "
+                                 "%.2f MB" % (estimate["frames"],
+                                              estimate["bytes"] / 1e6,
+                                              sizeBudget / 1e6))
+        if compress == "auto":
+            self.scale, self.colors, self.frameBytes = scale, colors, frameBytes
+            self.uniqueFrames = uniqueFrames
+            self.downscale = downscale
         self.compress = compress
+        self.encoder = encoder
+        self.trim = trim
+        self.layers = layers
+        self.order = order
+        self.layout = layout
+        self.sizeBudget = sizeBudget
         self.fileName = fileName
-        file = open(fileName, "w")
-        file.write(self.html())
-        file.close()
+        self.buildReport = {}
+        if assets == "external":
+            assetDir = os.path.splitext(fileName)[0] + "_files"
+            os.makedirs(assetDir, exist_ok=True)
+        else:
+            assetDir = None
+        if cache is True:
+            cache = FrameCache()
+        if cache:
+            cache.resetStatistics()
+        # frames are written as they are rendered, so memory use does not
+        # grow with the number of frames
+        if progress is True:
+            progress = _print_progress
+        with open(fileName, "w") as file:
+            for part in self._iter_html(workers=workers, cache=cache or None,
+                                        assetDir=assetDir, layout=layout,
+                                        sampling=sampling, progress=progress or None):
+                file.write(part)
         self.overallCaption = ""
-        return("Interactive figure saved in file %s" % fileName)
+        report = self.buildReport
+        report["bytes"] = os.path.getsize(fileName)
+        if assetDir is not None:
+            report["bytes"] += report["pngBytes"]
+        if sizeBudget is not None and report["bytes"] > sizeBudget:
+            warnings.warn("interactive figure takes %.2f MB, more than size "
+                          "budget of %.2f MB" % (report["bytes"] / 1e6,
+                                                 sizeBudget / 1e6))
+        if cache:
+            report["cacheHits"] = cache.hits
+            report["cacheMisses"] = cache.misses
+            report["cacheHitRate"] = cache.hits / max(1, cache.hits + cache.misses)
+        summary = "%d frames of %d combinations, %d unique, deduplication ratio %.1f" % (
+            report["frames"], report["combinations"],
+            report.get("uniqueFrames", 0),
+            report["frames"] / max(1, report.get("uniqueFrames", 0)))
+        if cache:
+            summary += "; frame cache: %d hits, %d misses" % (cache.hits, cache.misses)
+        return("Interactive figure saved in file %s (%s)" % (fileName, summary))
 
 
     def saveStaticFigure(self, fileName:str, values: List[List]=None, figuresPerRow=2,
@@ -475,6 +2559,10 @@ input[type=range].viridisrange::-webkit-slider-runnable-track {
             labelGenerator (_type_, optional): _description_.
             compress (bool, optional): Should we use [pngquant](https://pngquant.org/) to compress final
                 figure.
+
+        For figures made of independent panels, each static panel shows
+        frames of all panels for the given arguments side by side, and
+        their captions are joined.
         """
         self.compress = compress
         names = [name for name in self.widgets]
@@ -507,13 +2595,25 @@ input[type=range].viridisrange::-webkit-slider-runnable-track {
                     label, labelLatex = labelGenerator(figureIndex,
                                                        dict(zip(names, values[figureIndex])))
 
-                fig, caption = self.function(**dict(zip(names, values[figureIndex])))
+                arguments = dict(zip(names, values[figureIndex]))
+                panelImages = []
+                captions = []
+                for panel in self.panels:
+                    kwargs = {name: arguments[name] for name in panel.dependencies}
+                    if panel.sweep is not None:
+                        # function gives figure for each of the given values
+                        kwargs[panel.sweep] = np.array([kwargs[panel.sweep]])
+                        fig, caption = next(iter(panel.function(**kwargs)))
+                    else:
+                        fig, caption = panel.function(**kwargs)
+                    png = _get_png(fig, compress=compress)
+                    panelImages.append(Image.open(BytesIO(png)))
+                    captions.append(caption)
 
                 if figureIndex != 0: overallCaption += ", "
-                overallCaption +=  label + " " + caption
+                overallCaption +=  label + " " + "; ".join(captions)
 
-                png = _get_png(fig, compress=compress)
-                imgs.append(Image.open(BytesIO(png)))
+                imgs.append(_side_by_side(panelImages))
 
                 if labelPanels:
                     l = Image.open(labelLatex)
@@ -8,7 +8,7 @@ from io import BytesIO, StringIO
 import binascii
 from html import escape
 import os
-import pngquant
+import warnings
 
 from PIL import Image
 import numpy as np
@@ -16,6 +16,7 @@ import numpy as np
 from string import ascii_lowercase
 from .latex2png import latex2png
 from .style import white_to_transparency
+from .compress import fit_png, pngquant, MIN_COLORS
 
 import matplotlib as mpl
 mpl.rcParams['xtick.minor.visible'] = True
@@ -74,6 +75,10 @@ def _html2latex(html):
     return _htmlEncoding2LaTeX(latex)
 
 def _get_encoded_png(image, maxWidth=5000, compress=False):
+    return _png_data_uri(_get_png_bytes(image, maxWidth=maxWidth,
+                                        compress=compress))
+
+def _get_png_bytes(image, maxWidth=5000, compress=False):
     image = _get_png_image(image, maxWidth=maxWidth)
     in_mem_file = BytesIO()
     image.save(in_mem_file, format = "PNG")
@@ -81,11 +86,35 @@ def _get_encoded_png(image, maxWidth=5000, compress=False):
     in_mem_file.seek(0)
     img_bytes = in_mem_file.read()
     if compress:
-        pngquant.config(min_quality=40, max_quality=100)
-        _, img_bytes = pngquant.quant_data(img_bytes)
+        img_bytes = pngquant(img_bytes, quality=(40, 100))
+    return img_bytes
 
+def _png_data_uri(img_bytes):
     return "data:image/png;base64,{0}".format(base64.b64encode(img_bytes).decode("utf-8"))
 
+# marks where event image goes in event HTML, until images are encoded;
+# delimited, so that placeholder of one event is not a prefix of another
+_IMAGE_PLACEHOLDER = "{ifigures-image:%s}"
+
+def _fit_pngs(pngs, maxBytes, downscale=()):
+    """Compresses pngs so that together they take at most maxBytes when
+    base64 encoded. Each png gets share of bytes left in proportion to its
+    size when quantized to `MIN_COLORS` colours. Only pngs whose
+    indices are in downscale can be made smaller. Returns list of (png,
+    number of colours or None if not quantized, scale)."""
+    planned = [pngquant(png, quality=(0, 100), colors=MIN_COLORS)
+               for png in pngs]
+    plannedLeft = sum(len(p) for p in planned)
+    bytesLeft = maxBytes * 3 / 4  # base64
+    fitted = []
+    for i, png in enumerate(pngs):
+        share = bytesLeft * len(planned[i]) / max(1, plannedLeft)
+        fitted.append(fit_png(png, share, downscale=i in downscale,
+                              quantized={MIN_COLORS: planned[i]}))
+        bytesLeft -= len(fitted[-1][0])
+        plannedLeft -= len(planned[i])
+    return fitted
+
 def _get_png_image(image, maxWidth=5000):
     size = image.size;
     if (size[0]>maxWidth):
@@ -364,14 +393,28 @@ a{{
                         "offsetY" : offsetY})
         return
 
-    def saveStandaloneHTML(self, fileName:str):
+    def saveStandaloneHTML(self, fileName:str, sizeBudget:int=None,
+                           downscale:bool=False):
         """_summary_
 
         Args:
             fileName (str): _description_
+            sizeBudget (int): optional maximal size of the saved file in
+                bytes. If given, images are quantized with pngquant to
+                the most colours at which the file fits in sizeBudget.
+                If timeline is compressed, images are first compressed as
+                without sizeBudget, and only those that still don't fit
+                are quantized further. Numbers of colours chosen for each image are recorded in
+                `buildReport["images"]`. If file still takes more bytes,
+                warning is issued. Defaults to None.
+            downscale (bool): if True, event images that don't fit in
+                their share of sizeBudget even with few colours are reduced
+                in size. Background image is never reduced, since click
+                positions on it are given in pixels. Defaults to False.
         """
         eventsHTML = []
         imageMap = []
+        images = []  # (eventId or "background", png)
 
         im = Image.open(self.backgroundImage)
 
@@ -397,10 +440,11 @@ a{{
 
             if e["image"] != None:
                 sideImage = Image.open(e["image"])
+                images.append((eid, _get_png_bytes(sideImage, maxWidth=500,
+                    compress=self.compress)))
                 eventsHTML.append(self.event_template.format(eventId = eid,
                                                title=e["title"],
-                                               imageName=_get_encoded_png(sideImage,
-                                                maxWidth=500, compress=self.compress),
+                                               imageName=_IMAGE_PLACEHOLDER % eid,
                                                year=e["year"],
                                                text=e["text"],
                                                credits=e["credits"]))
@@ -420,25 +464,54 @@ a{{
         eventsHTML = "".join(eventsHTML)
         imageMap = "".join(imageMap)
 
+        images.append(("background", _get_png_bytes(im,
+            compress=self.compress)))
+        self.buildReport = {"images": []}
+        if sizeBudget is not None:
+            # everything but images takes the same space whatever the images are
+            empty = self._standalone_html(im, imageMap, intro, eventsHTML,
+                                          {name: _png_data_uri(b"") for name, png in images})
+            fitted = _fit_pngs([png for name, png in images],
+                               sizeBudget - len(empty.encode("utf-8")),
+                               downscale=range(len(images) - 1) if downscale
+                               else ())
+            for (name, png), (fittedPng, colors, scale) in zip(images, fitted):
+                self.buildReport["images"].append({"image": name,
+                                                   "colors": colors,
+                                                   "scale": scale,
+                                                   "pngBytes": len(fittedPng)})
+            images = [(name, png) for (name, original), (png, colors, scale)
+                      in zip(images, fitted)]
+        r = self._standalone_html(im, imageMap, intro, eventsHTML,
+                                  {name: _png_data_uri(png) for name, png in images})
+        self.buildReport["bytes"] = len(r.encode("utf-8"))
+        if sizeBudget is not None and self.buildReport["bytes"] > sizeBudget:
+            warnings.warn("interactive timeline takes %.2f MB, more than size "
+                          "budget of %.2f MB" % (self.buildReport["bytes"] / 1e6,
+                                                 sizeBudget / 1e6))
+        file = open(fileName, "w")
+        file.write(r)
+        file.close()
+        self.fileName = fileName
 
+        return
 
-        r = self.standalone_template.format(title=self.title,
+    def _standalone_html(self, im, imageMap, intro, eventsHTML, images):
+        """HTML of timeline, with images given as data URIs for each event
+        id and for "background"."""
+        images = dict(images)
+        backgroundImage = images.pop("background")
+        for eventId, image in images.items():
+            eventsHTML = eventsHTML.replace(_IMAGE_PLACEHOLDER % eventId, image)
+        return self.standalone_template.format(title=self.title,
                                        css=self.css.format(eventBoxWidth=im.size[0]-30),
-                                       backgroundImage=_get_encoded_png(im,
-                                        compress=self.compress
-                                        ),
+                                       backgroundImage=backgroundImage,
                                        imagemap=imageMap,
                                        imageWidth=im.size[0],
                                        imageHeight=im.size[1],
                                        introduction=intro,
                                        events=eventsHTML
                                       )
-        file = open(fileName, "w")
-        file.write(r)
-        file.close()
-        self.fileName = fileName
-
-        return
 
     def saveStaticFigure(self, folderName:str):
         """_summary_
@@ -142,10 +142,10 @@ class DropDownWidget(StaticWidget):
         self._values = values
         self.delimiter = delimiter
         if labels is None:
-            labels = map(str, values)
+            labels = [str(value) for value in values]
         elif len(labels) != len(values):
             raise ValueError("length of labels must match length of values")
-        self.labels = labels
+        self.labels = list(labels)
 
         if default is None:
             self.default = values[0]
@@ -200,10 +200,10 @@ class RadioWidget(StaticWidget):
         self.delimiter = delimiter
 
         if labels is None:
-            labels = map(str, values)
+            labels = [str(value) for value in values]
         elif len(labels) != len(values):
             raise ValueError("length of labels must match length of values")
-        self.labels = labels
+        self.labels = list(labels)
 
         if default is None:
             self.default = values[0]